@@ -0,0 +1,268 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+from datetime import datetime
+from supernodegraph import NodeCGMW, GRAPH_CLASSES
+from graph import ClusterWrapper, ConstraintStore
+from scheduler import seed_schedulers
+
+# Benchmarks the graph, metrics, snapshot and meta-labelling operations on
+# synthetic datasets, and compares the timings against a stored baseline.
+#
+#   python bench.py --sizes 1000 10000 100000 --output bench_baseline.json
+#   python bench.py --baseline bench_baseline.json   (exits with 1 on a regression)
+#
+# Timings only compare on one machine, so no baseline is committed: record one
+# on the machine that runs the checks (bench_baseline.json is gitignored).
+
+def cluster_sizes(num_nodes, distribution, rng):
+    """
+        Returns a list of cluster sizes adding up to `num_nodes`, drawn from `distribution`:
+        - 'uniform' : every cluster holds 5 to 15 nodes
+        - 'zipf' : heavy-tailed sizes, with a few clusters far larger than the rest
+        - 'singletons' : mostly lone nodes, with some clusters of up to 50
+    """
+    sizes = []
+    remaining = num_nodes
+
+    while remaining > 0:
+        if distribution == 'uniform':
+            size = rng.randint(5, 15)
+        elif distribution == 'zipf':
+            size = min(int(rng.paretovariate(1.2)), max(1, num_nodes // 10))
+        elif distribution == 'singletons':
+            size = 1 if rng.random() < 0.7 else rng.randint(2, 50)
+        else:
+            raise ValueError('Unknown cluster size distribution {}'.format(distribution))
+
+        size = min(size, remaining)
+        sizes.append(size)
+        remaining -= size
+
+    return sizes
+
+def synthetic_dataset(num_nodes, distribution, seed=0):
+    """
+        Returns (actual clusters, predicted clusters) as lists of lists of node names.
+
+        The predicted clustering is the actual one with 5% of the nodes moved to
+        another cluster, 5% of the clusters split in two and 2% merged into another.
+    """
+    rng = random.Random(seed)
+
+    labels = []
+    names = []
+    for cluster, size in enumerate(cluster_sizes(num_nodes, distribution, rng)):
+        labels.extend([cluster] * size)
+        names.extend('bench/{:07d}/{:04d}.jpg'.format(cluster, i) for i in range(size))
+
+    num_clusters = labels[-1] + 1 if len(labels) > 0 else 0
+    predicted = list(labels)
+
+    for node in range(num_nodes):
+        if rng.random() < 0.05:
+            predicted[node] = rng.randrange(num_clusters)
+
+    remap = list(range(num_clusters))
+    next_label = num_clusters
+    split = set()
+    for cluster in range(num_clusters):
+        r = rng.random()
+        if r < 0.05:
+            split.add(cluster)
+        elif r < 0.07:
+            remap[cluster] = rng.randrange(num_clusters)
+
+    for node, label in enumerate(predicted):
+        if label in split and node % 2 == 1:
+            predicted[node] = next_label + label
+        else:
+            predicted[node] = remap[label]
+
+    return _group(names, labels), _group(names, predicted)
+
+def _group(names, labels):
+    clusters = dict()
+    for name, label in zip(names, labels):
+        clusters.setdefault(label, []).append(name)
+    return list(clusters.values())
+
+def run_case(graph, num_nodes, distribution, decisions=1000, unions=1000, vertex_limit=10000, seed=0):
+    """
+        Times every benchmarked operation once on a fresh dataset and returns {operation: seconds}.
+    """
+    actual_clusters, predicted_clusters = synthetic_dataset(num_nodes, distribution, seed)
+    rng = random.Random(seed)
+    seed_schedulers(seed)
+    timings = dict()
+
+    def timed(operation, function):
+        start = time.perf_counter()
+        result = function()
+        timings[operation] = time.perf_counter() - start
+        return result
+
+    def build():
+        cg = NodeCGMW(graph_class=GRAPH_CLASSES[graph])
+        cg.actual.add_clusters(actual_clusters)
+        cg.predicted.add_clusters(predicted_clusters)
+        return cg
+
+    cg = timed('build', build)
+
+    timed('get_clusters', cg.actual.get_clusters)
+    timed('metrics_contingency', lambda: cg.metrics('contingency'))
+    timed('metrics_numpy', lambda: cg.metrics('numpy'))
+    timed('metrics_parallel', lambda: cg.metrics('parallel'))
+    timed('metrics_report', cg.report)
+    if num_nodes <= vertex_limit:
+        timed('metrics_vertex', lambda: cg.metrics('vertex'))
+
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = os.path.join(directory, 'bench.json')
+        timed('json_save', lambda: cg.save_to_json_file(json_path))
+        timed('json_load', lambda: NodeCGMW(graph_class=GRAPH_CLASSES[graph]).load_from_json_file(json_path))
+
+        snapshot_path = os.path.join(directory, 'bench.npz')
+        timed('snapshot_save', lambda: cg.save_to_snapshot(snapshot_path))
+        timed('snapshot_load', lambda: NodeCGMW(graph_class=GRAPH_CLASSES[graph]).load_from_snapshot(snapshot_path))
+
+    cw = timed('wrapper_init', lambda: ClusterWrapper(cg))
+
+    def decide():
+        for _ in range(decisions):
+            pairing = cw.suggest_pairing()
+            if pairing is False: break
+
+            mc1, mc2 = pairing
+            if rng.random() < 0.3:
+                cw.is_good_pairing(mc1, mc2)
+            else:
+                cw.is_bad_pairing(mc1, mc2)
+
+    def split():
+        for _ in range(decisions // 10):
+            cluster, _ = cw.suggest_intra_pairing()
+            if len(cw.clusters[cluster.id]) < 2: continue
+            image1 = cw.get_node_name_from_cluster(cluster)
+            image2 = cw.get_node_name_from_cluster(cluster)
+            if image1 != image2:
+                cw.problem_with_cluster(cluster, image1, image2)
+
+    timed('wrapper_decisions', decide)
+    timed('wrapper_splits', split)
+    timed('wrapper_update', cw.update_graph_and_return)
+
+    vertices = list(cg.actual.vertices)
+    pairs = [(rng.choice(vertices), rng.choice(vertices)) for _ in range(unions)]
+
+    def add_neighbors():
+        for vertex1, vertex2 in pairs:
+            vertex1.add_neighbor(vertex2)
+
+    timed('add_neighbor', add_neighbors)
+
+    # late in a session: one cluster can only be the last 5 of all the others
+    constraints = ConstraintStore(max(num_nodes, 7))
+    constraints.link_all((), [(0, other) for other in range(1, len(constraints.live) - 5)])
+
+    def choose_scarce():
+        for _ in range(decisions):
+            constraints.cannot_link(*rng.sample(range(1, len(constraints.live)), 2))
+            constraints.add()
+            constraints.choose_can_be(0)
+
+    timed('choose_scarce', choose_scarce)
+
+    return timings
+
+def run(graphs, sizes, distributions, repeat=3, **options):
+    """
+        Runs every case `repeat` times and returns {case: {operation: best seconds}},
+        where a case is named '<graph>/<distribution>/<size>'.
+    """
+    results = dict()
+
+    # a throwaway run, so one-off costs like importing numpy are not charged to the first case
+    for graph in graphs:
+        run_case(graph, 100, 'uniform')
+
+    for graph in graphs:
+        for distribution in distributions:
+            for size in sizes:
+                case = '{}/{}/{}'.format(graph, distribution, size)
+                best = dict()
+
+                for _ in range(repeat):
+                    for operation, seconds in run_case(graph, size, distribution, **options).items():
+                        best[operation] = min(seconds, best.get(operation, seconds))
+
+                results[case] = best
+                print('{:<28} {}'.format(case, '  '.join('{} {:.4f}s'.format(op, s) for op, s in best.items())), flush=True)
+
+    return results
+
+def compare(results, baseline, tolerance=0.25, noise_floor=0.005):
+    """
+        Returns a list of (case, operation, baseline seconds, seconds) for every timing more than
+        `tolerance` slower than the baseline, ignoring differences below `noise_floor` seconds.
+    """
+    regressions = []
+
+    for case, timings in results.items():
+        for operation, seconds in timings.items():
+            before = baseline.get(case, dict()).get(operation)
+            if before is None: continue
+
+            if seconds > before * (1 + tolerance) and seconds - before > noise_floor:
+                regressions.append((case, operation, before, seconds))
+
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks the cluster-checker on synthetic datasets.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='Numbers of nodes to benchmark (e.g. 1000 10000 100000 1000000).')
+    parser.add_argument('--graph', type=str, nargs='+', choices=sorted(GRAPH_CLASSES), default=['node', 'array'], help='The ClusterGraph implementations to benchmark.')
+    parser.add_argument('--distribution', type=str, nargs='+', choices=['uniform', 'zipf', 'singletons'], default=['uniform', 'zipf', 'singletons'], help='The cluster size distributions to benchmark.')
+    parser.add_argument('--repeat', type=int, default=3, help='How often every case is run; the fastest run counts.')
+    parser.add_argument('--decisions', type=int, default=1000, help='How many pairing decisions are timed on the ClusterWrapper.')
+    parser.add_argument('--vertex-limit', type=int, default=10000, help='The largest size at which the quadratic "vertex" metrics are timed.')
+    parser.add_argument('--output', type=str, default='bench_results.json', help='Where to write the results as json.')
+    parser.add_argument('--baseline', type=str, default=None, help='A results file of an earlier run to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='How much slower than the baseline (as a fraction) an operation may be before it counts as a regression.')
+
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline is not None:
+        if os.path.abspath(args.baseline) == os.path.abspath(args.output):
+            parser.error('--output would overwrite the --baseline it is compared against')
+
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)['results']
+
+    results = run(args.graph, args.sizes, args.distribution, repeat=args.repeat, decisions=args.decisions, vertex_limit=args.vertex_limit)
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': results
+        }, f, indent=4)
+    print('Wrote {}'.format(args.output))
+
+    if baseline is not None:
+        regressions = compare(results, baseline, tolerance=args.tolerance)
+        for case, operation, before, seconds in regressions:
+            print('REGRESSION {} {}: {:.4f}s -> {:.4f}s ({:+.0%})'.format(case, operation, before, seconds, seconds / before - 1))
+
+        if len(regressions) > 0:
+            sys.exit(1)
+
+        print('No regressions against {}'.format(args.baseline))
@@ -8,6 +8,11 @@ import numpy as np
 from numpy.random import default_rng
 from functools import partial
 from datetime import datetime
+from imagecache import ImagePrefetcher
+from thumbnails import dataset_store
+from manifest import dataset_manifest, dataset_name
+from graph import IndexedSet
+import instrument
 
 def get_timestamp_string():
     dt = datetime.now()
@@ -18,13 +23,15 @@ class DisplayState(Enum):
     SUBDIR_LEVEL = 1
 
 class Display:
-    def __init__(self, master_dir):
+    def __init__(self, master_dir, manifest=None):
         self.master_dir = master_dir
 
-        self.seen = set()
+        # the listing of every cluster folder, so finishing a cluster does not walk the dataset again
+        self.manifest = dataset_manifest(master_dir) if manifest is None else manifest
+
+        self.seen = set() # cluster folders checked in this or an earlier session
         
-        name = self.master_dir.split('/')[-1]
-        self.filename = 'data/{}.txt'.format(name)
+        self.filename = 'data/{}.txt'.format(dataset_name(self.master_dir))
         # create our file
         try:
             with open(self.filename, 'x'):
@@ -32,6 +39,9 @@ class Display:
         except:
             self.seen = self._load_from_file(self.filename)
 
+        # the cluster folders still to check, so picking one never looks at the checked ones
+        self.available = IndexedSet(d for d in self.manifest.subdirs(self.master_dir) if d not in self.seen)
+
         self.state = DisplayState.DIR_LEVEL
         self.directory = self._choose_random_directory(self.master_dir)
 
@@ -45,6 +55,13 @@ class Display:
         self.num_rows = 5
         self.num_cols = 5
 
+        # prebuilt thumbnails (see `python main.py index`), if any
+        self.thumbnails = dataset_store(self.master_dir, manifest=self.manifest)
+
+        # decodes the next few comparison images while the current pair is on screen
+        self.lookahead = 4
+        self.prefetcher = ImagePrefetcher((self.width, self.height), thumbnails=self.thumbnails)
+
         self._set_mainframe()
 
         self._set_dirframe()
@@ -53,23 +70,23 @@ class Display:
         self.root.mainloop()
 
     def _load_from_file(self, fname):
+        # every checked cluster has a record starting with '*' and its folder
         with open(fname) as f:
-            l = f.readlines()
-
-        return set([x for x in l if x[0] == '*'])
+            return set([x[1:].rstrip('\n') for x in f if x[0] == '*'])
 
     def _choose_random_directory(self, master_dir):
-        cluster_dirs = ['{}/{}'.format(self.master_dir, d) for d in next(os.walk(master_dir))[1]]
-
-        available = set(cluster_dirs).difference(self.seen)
-
-        if len(available) == 0: # no more available folders!
+        if len(self.available) == 0: # no more available folders!
             return False
 
-        return random.choice(list(available))
+        directory = self.available.choice()
+        self.available.remove(directory)
+
+        return directory
 
+    @instrument.timed('display.close')
     def _handle_close(self):
         # TODO save all
+        self.prefetcher.shutdown()
         self.root.destroy()
 
     def _set_mainframe(self):
@@ -85,7 +102,7 @@ class Display:
         self.mainframe.grid(column=0, row=0, sticky=NS)
 
     def _get_files_from_dir(self, d):
-        return [f for f in os.listdir(d) if os.path.isfile(os.path.join(d, f))]
+        return self.manifest.files(d)
 
     def _get_image_spread(self, upper_bound=25):
         rng = default_rng()
@@ -97,15 +114,20 @@ class Display:
         return list(np.array(self.images)[idx])
 
     def _start_eval(self, filepath):
+        instrument.answered()
+
         self.model_face = filepath
         self.state = DisplayState.SUBDIR_LEVEL
 
         self.results = list()
 
+        self.prefetcher.prefetch([self.model_face] + self.images[:self.lookahead])
+
         self.root.title('Are these from the same cluster?')
 
         self._set_subdirframe(0)
 
+    @instrument.timed('display.render_pair')
     def _set_subdirframe(self, ix):
         """
             Sets the subdirectory view frame of the GUI
@@ -115,18 +137,15 @@ class Display:
             self._new_cluster()
             return
 
-        imwidth = self.width
-        imheight = self.height
-
         self.subdirframe = ttk.Frame(master=self.mainframe, borderwidth=2, relief=GROOVE)
         self.subdirframe.grid(column=0, row=0, sticky=NSEW)
 
-        model_img = ImageTk.PhotoImage(Image.open(self.model_face).resize((imwidth, imheight)))
+        model_img = ImageTk.PhotoImage(self.prefetcher.get(self.model_face))
         model = ttk.Label(master=self.subdirframe, image=model_img)
         model.image = model_img
         model.grid(column=0, row=0, sticky=NSEW)
 
-        comp_img = ImageTk.PhotoImage(Image.open(self.images[ix]).resize((imwidth, imheight)))
+        comp_img = ImageTk.PhotoImage(self.prefetcher.get(self.images[ix]))
         comp = ttk.Label(master=self.subdirframe, image=comp_img)
         comp_img.image = comp_img
         comp.grid(column=1, row=0, sticky=NSEW)
@@ -139,15 +158,21 @@ class Display:
         yes.grid(column=1, row=1, sticky=NSEW)
         self.subdirframe.bind("y", partial(self._yes, ix))
 
+        self.prefetcher.prefetch(self.images[ix + 1:ix + 1 + self.lookahead])
+
+        instrument.shown('pair')
 
     def _yes(self, ix):
+        instrument.answered()
         self.results.append(True)
         self._set_subdirframe(ix+1)
 
     def _no(self, ix):
+        instrument.answered()
         self.results.append(False)
         self._set_subdirframe(ix+1)
 
+    @instrument.timed('display.save_eval')
     def _save_eval(self, ims, res):
         wrong = [x[0] for x in zip(self.images, self.results) if not x[1]]
         with open(self.filename, 'a') as f:
@@ -172,6 +197,7 @@ class Display:
 
         self._set_dirframe()
 
+    @instrument.timed('display.render_grid')
     def _set_dirframe(self):
         """
             Sets the directory view frame of the GUI
@@ -204,13 +230,24 @@ class Display:
                     getattr(self, 'grid_{}{}'.format(row, col)).grid(column=col, columnspan=1, row=row, rowspan=1, sticky=NSEW)
                 else:
                     img_path = impaths[ix]
-                    image = ImageTk.PhotoImage(Image.open(img_path).resize((imwidth, imheight)))
+                    image = ImageTk.PhotoImage(self._grid_image(img_path, imwidth, imheight))
                     setattr(self, 'grid_{}{}'.format(row, col), ttk.Button(master=self.imgs, image=image, command=partial(self._start_eval, img_path)))
                     getattr(self, 'grid_{}{}'.format(row, col)).grid(column=col, columnspan=1, row=row, rowspan=1, sticky=NSEW)
                     getattr(self, 'grid_{}{}'.format(row, col)).image=image
 
+        instrument.shown('grid')
+
+    @instrument.timed('images.grid')
+    def _grid_image(self, img_path, imwidth, imheight):
+        thumbnail = self.thumbnails.grid(img_path) if self.thumbnails.sizes['grid'] == (imwidth, imheight) else None
+
+        if thumbnail is not None:
+            return Image.fromarray(thumbnail)
+
+        return Image.open(img_path).resize((imwidth, imheight))
+
 class MetaDisplay:
-    def __init__(self, cluster_interface, trust=75):
+    def __init__(self, cluster_interface, trust=75, thumbnails=None):
         self.ci = cluster_interface
         self.trust = trust
 
@@ -219,9 +256,16 @@ class MetaDisplay:
         self.num_rows = 5
         self.num_cols = 5
 
+        self.upcoming = None # the question after the one on screen, drawn ahead so it can be prefetched
+        self.prefetcher = ImagePrefetcher((self.width, self.height), thumbnails=thumbnails)
+
         self._set_mainframe()
 
+        # e.g. ranks clusters by similarity on a background thread, while the first questions are random
+        self.ci.scheduler.start(self.ci)
+
         self._set_subdirframe()
+        self._poll_scheduler()
 
 
         self.root.protocol('WM_DELETE_WINDOW', self._handle_close)
@@ -237,6 +281,7 @@ class MetaDisplay:
 
         return random.choice(list(available))
 
+    @instrument.timed('display.close')
     def _handle_close(self):
 
         try:
@@ -245,8 +290,10 @@ class MetaDisplay:
             pass
         
         t = f'metadata/{get_timestamp_string()}'
-        self.ci.save(t)
-        print('Saved to {}.json'.format(t))
+        print('Saved to {}'.format(self.ci.save(t)))
+        if self.ci.journal is not None:
+            self.ci.journal.close()
+        self.prefetcher.shutdown()
         self.root.destroy()
 
     def _set_mainframe(self):
@@ -261,78 +308,135 @@ class MetaDisplay:
         self.mainframe = ttk.Frame(self.root, padding="3 3 12 12")
         self.mainframe.grid(column=0, row=0, sticky=NS)
 
-    def _set_subdirframe(self):
+    def _set_title(self):
+        title = 'Do these belong to the same cluster? Potency: {}'.format(self.ci.potency)
+        if self.ci.live_metrics is not None:
+            title += '  P {:.3f} R {:.3f} F {:.3f}'.format(*self.ci.live_metrics.scores())
+
+        progress = self.ci.scheduler.progress()
+        if progress is not None:
+            title += '  ({})'.format(progress)
+
+        self.root.title(title)
+
+    def _poll_scheduler(self):
         """
-            Sets the subdirectory view frame of the GUI
+            Keeps the progress of the scheduler's preparation in the title until it is done.
         """
-        check_self = random.randint(0, 100) > self.trust
+        self._set_title()
 
-        c = self.ci.clusters
+        if self.ci.scheduler.progress() is not None:
+            self.root.after(500, self._poll_scheduler)
+
+    @instrument.timed('display.next_question')
+    def _next_question(self):
+        """
+            Draws the next question as a tuple of (cluster1, cluster2, image1, image2),
+            where cluster1 is cluster2 for a self-check, or returns None if no pairings are left.
+        """
+        check_self = random.randint(0, 100) > self.trust
 
-        self.ci.set_potency()
-        self.root.title('Do these belong to the same cluster? Potency: {}'.format(self.ci.potency))
         if check_self:
             cluster,_ = self.ci.suggest_intra_pairing()
+            return cluster, cluster, self.ci.get_node_name_from_cluster(cluster), self.ci.get_node_name_from_cluster(cluster)
 
-            imwidth = self.width
-            imheight = self.height
+        pairing = self.ci.suggest_pairing()
 
-            im1,im2 = self.ci.get_node_name_from_cluster(cluster),self.ci.get_node_name_from_cluster(cluster)
+        if pairing is False:
+            return None
+
+        im1,im2 = pairing
+        return im1, im2, self.ci.get_node_name_from_cluster(im1), self.ci.get_node_name_from_cluster(im2)
+
+    def _take_question(self):
+        """
+            Returns the question drawn ahead of time, unless the last answer settled it.
+        """
+        question = self.upcoming
+        self.upcoming = None
 
+        if question is None:
+            return self._next_question()
+
+        if self.ci.still_open(*question):
+            return question
+
+        cluster1, cluster2 = question[:2]
+
+        # a split only moved the images drawn for a pairing that is still open, so it is
+        # asked about with new images rather than left to the scheduler's random fallback
+        if cluster1 is not cluster2 and self.ci.pairing_open(cluster1, cluster2):
+            return cluster1, cluster2, self.ci.get_node_name_from_cluster(cluster1), self.ci.get_node_name_from_cluster(cluster2)
+
+        return self._next_question()
+
+    @instrument.timed('display.render_question')
+    def _set_subdirframe(self):
+        """
+            Sets the subdirectory view frame of the GUI
+        """
+        question = self._take_question()
+
+        self.ci.set_potency()
+        self._set_title()
+
+        if question is None:
             self.subdirframe = ttk.Frame(master=self.mainframe, borderwidth=2, relief=GROOVE)
-            self.subdirframe.grid(column=0, row=0, sticky=NSEW)
-            
-            model_img = ImageTk.PhotoImage(Image.open(im1).resize((imwidth, imheight)))
-            model = ttk.Label(master=self.subdirframe, image=model_img)
-            model.image = model_img
-            model.grid(column=0, row=0, sticky=NSEW)
-
-            comp_img = ImageTk.PhotoImage(Image.open(im2).resize((imwidth, imheight)))
-            comp = ttk.Label(master=self.subdirframe, image=comp_img)
-            comp_img.image = comp_img
-            comp.grid(column=1, row=0, sticky=NSEW)
-
-            no = Button(master=self.subdirframe, text='NO', height=10, command=partial(self.ci.problem_with_cluster, cluster, im1, im2, self._set_subdirframe))
+            self.subdirframe.grid(column=0,row=0,sticky=NSEW)
+            self.label = ttk.Label(master=self.subdirframe, text='No more available clusters. Please exit, (this will save automatically).')
+            self.label.grid(column=0,row=0,sticky=NSEW)
+            return
+
+        cluster1, cluster2, im1, im2 = question
+
+        self.subdirframe = ttk.Frame(master=self.mainframe, borderwidth=2, relief=GROOVE)
+        self.subdirframe.grid(column=0, row=0, sticky=NSEW)
+
+        model_img = ImageTk.PhotoImage(self.prefetcher.get(im1))
+        model = ttk.Label(master=self.subdirframe, image=model_img)
+        model.image = model_img
+        model.grid(column=0, row=0, sticky=NSEW)
+
+        comp_img = ImageTk.PhotoImage(self.prefetcher.get(im2))
+        comp = ttk.Label(master=self.subdirframe, image=comp_img)
+        comp_img.image = comp_img
+        comp.grid(column=1, row=0, sticky=NSEW)
+
+        if cluster1 is cluster2: # checking ourselves on an existing cluster
+            no = Button(master=self.subdirframe, text='NO', height=10, command=partial(self._answer, self.ci.problem_with_cluster, cluster1, im1, im2))
+            no.grid(column=0, row=1, sticky=NSEW)
+            self.root.bind('n', lambda event: self._answer(self.ci.problem_with_cluster, cluster1, im1, im2))
+
+            yes = Button(master=self.subdirframe, text='YES', height=10, command=partial(self._answer, None))
+            yes.grid(column=1, row=1, sticky=NSEW)
+            self.root.bind('y', lambda event: self._answer(None))
+        else:
+            no = Button(master=self.subdirframe, text='NO', height=10, command=partial(self._answer, self.ci.is_bad_pairing, cluster1, cluster2))
             no.grid(column=0, row=1, sticky=NSEW)
-            self.root.bind('n', lambda event: self.ci.problem_with_cluster(cluster, im1, im2, self._set_subdirframe))
+            self.root.bind('n', lambda event: self._answer(self.ci.is_bad_pairing, cluster1, cluster2))
 
-            yes = Button(master=self.subdirframe, text='YES', height=10, command=self._set_subdirframe)
+            yes = Button(master=self.subdirframe, text='YES', height=10, command=partial(self._answer, self.ci.is_good_pairing, cluster1, cluster2))
             yes.grid(column=1, row=1, sticky=NSEW)
-            self.root.bind('y', lambda event: self._set_subdirframe())
+            self.root.bind('y', lambda event: self._answer(self.ci.is_good_pairing, cluster1, cluster2))
+
+        # draw the following question now, so its images decode while this one is on screen
+        self.upcoming = self._next_question()
+        if self.upcoming is not None:
+            self.prefetcher.prefetch(self.upcoming[2:])
+
+        instrument.shown('self-check' if cluster1 is cluster2 else 'pair')
+
+    def _answer(self, decision, *args):
+        """
+            Applies the annotator's answer, `decision` (a `ClusterWrapper` method, or None
+            if the answer changes nothing) called with `args`, and shows the next question.
+        """
+        instrument.answered()
+
+        if decision is None:
+            self._set_subdirframe()
         else:
-            pairing = self.ci.suggest_pairing()
-
-            if pairing is False:
-                self.subdirframe = ttk.Frame(master=self.mainframe, borderwidth=2, relief=GROOVE)
-                self.subdirframe.grid(column=0,row=0,sticky=NSEW)
-                self.label = ttk.Label(master=self.subdirframe, text='No more available clusters. Please exit, (this will save automatically).')
-                self.label.grid(column=0,row=0,sticky=NSEW)
-            else:
-                im1,im2 = pairing
-
-                imwidth = self.width
-                imheight = self.height
-
-                self.subdirframe = ttk.Frame(master=self.mainframe, borderwidth=2, relief=GROOVE)
-                self.subdirframe.grid(column=0, row=0, sticky=NSEW)
-
-                model_img = ImageTk.PhotoImage(Image.open(self.ci.get_node_name_from_cluster(im1)).resize((imwidth, imheight)))
-                model = ttk.Label(master=self.subdirframe, image=model_img)
-                model.image = model_img
-                model.grid(column=0, row=0, sticky=NSEW)
-
-                comp_img = ImageTk.PhotoImage(Image.open(self.ci.get_node_name_from_cluster(im2)).resize((imwidth, imheight)))
-                comp = ttk.Label(master=self.subdirframe, image=comp_img)
-                comp_img.image = comp_img
-                comp.grid(column=1, row=0, sticky=NSEW)
-
-                no = Button(master=self.subdirframe, text='NO', height=10, command=partial(self.ci.is_bad_pairing, im1, im2, self._set_subdirframe))
-                no.grid(column=0, row=1, sticky=NSEW)
-                self.root.bind('n', lambda event: self.ci.is_bad_pairing(im1, im2, self._set_subdirframe))
-
-                yes = Button(master=self.subdirframe, text='YES', height=10, command=partial(self.ci.is_good_pairing, im1, im2, self._set_subdirframe))
-                yes.grid(column=1, row=1, sticky=NSEW)
-                self.root.bind('y', lambda event: self.ci.is_good_pairing(im1, im2, self._set_subdirframe))
+            decision(*args, callback=self._set_subdirframe)
 
 if __name__ == "__main__":
     # root = Tk()  
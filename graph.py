@@ -61,12 +61,33 @@ class ClusterGraph:
         """
         raise NotImplementedError
 
+    def add_cluster(self, vertex_names):
+        """
+            Adds a new cluster with a vertex for each name in `vertex_names`.
+            Names that already have a vertex in this `ClusterGraph` are skipped.
+        """
+        raise NotImplementedError
+
+    def add_clusters(self, clusters):
+        """
+            Adds every list of vertex names in `clusters` as a cluster, as `add_cluster` would.
+        """
+        for vertex_names in clusters:
+            self.add_cluster(vertex_names)
+
     def get_clusters(self):
         """
             Return a list of sets of `ClusterVertex`, where each set represents a distinct cluster in this graph.
         """
         raise NotImplementedError
 
+    def cluster_names(self):
+        """
+            Yields a list of the vertex names of each cluster, one cluster at a time.
+        """
+        for cluster in self.get_clusters():
+            yield [vertex.name for vertex in cluster]
+
     def get_vertex(self, vertex_name):
         """
             Returns the vertex with the vertex_name if it exists, else False
@@ -105,9 +126,35 @@ class CGMetricsWrapper:
         """
         raise NotImplementedError
 
-    def metrics(self):
+    def save_to_snapshot(self, snapshot_path):
+        """
+            Saves this CGMetricsWrapper to a binary .npz snapshot: a table of
+            vertex names and the actual and predicted cluster label of each.
+        """
+        raise NotImplementedError
+
+    def load_from_snapshot(self, snapshot_path):
+        """
+            Constructs both `ClusterGraph`s from a snapshot written by `save_to_snapshot`.
+        """
+        raise NotImplementedError
+
+    def metrics(self, mode='vertex', workers=None):
         """
             Return the precision, recall, and fscore of this meta graph.
+
+            `mode` picks how they are computed:
+            - 'vertex' : compares the neighbor sets of every vertex
+            - 'contingency' : derives every score from one actual x predicted cluster overlap table
+            - 'numpy' : builds the same table with NumPy from two aligned int32 label arrays
+            - 'parallel' : like 'numpy', sharded by actual cluster over `workers` processes (one per core by default)
+        """
+        raise NotImplementedError
+
+    def report(self, top_k=10):
+        """
+            Returns the extended metrics of this meta graph (see `metrics.metrics_report`),
+            naming each of the `top_k` most impure predicted clusters by one of its vertices.
         """
         raise NotImplementedError
 
@@ -124,142 +171,700 @@ def get_timestamp_string():
     return '{}-{}-{}_{}:{}:{}'.format(dt.year,dt.month,dt.day,dt.hour,dt.minute,dt.second)
 
 import random
+import instrument
+from itertools import islice
+from scheduler import RandomScheduler
+from metrics import IncrementalMetrics, predicted_label_lookup
+
+class IndexedSet:
+    """
+        A set that also keeps its items in a list, so a uniformly random item
+        can be picked in O(1). Removing an item swaps the last item into its place.
+    """
+    def __init__(self, items=()):
+        self.items = list(dict.fromkeys(items))
+        self.positions = dict(zip(self.items, range(len(self.items)))) # item -> index in `items`
+
+    def add(self, item):
+        if item in self.positions: return
+        self.positions[item] = len(self.items)
+        self.items.append(item)
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def remove(self, item):
+        position = self.positions.pop(item)
+        last = self.items.pop()
+        if position < len(self.items):
+            self.items[position] = last
+            self.positions[last] = position
+
+    def discard(self, item):
+        if item in self.positions:
+            self.remove(item)
+
+    def difference_update(self, items):
+        for item in items:
+            self.discard(item)
+
+    def choice(self):
+        return self.items[random.randrange(len(self.items))]
+
+    def __contains__(self, item):
+        return item in self.positions
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+class ConstraintStore:
+    """
+        Tracks the meta-labelling decisions made between cluster ids.
+
+        Must-link decisions merge clusters into components (a disjoint-set forest
+        over cluster ids) and cannot-link decisions are a sparse set of edges
+        between component roots. Which clusters a cluster could still be is
+        worked out from these on demand rather than stored per cluster.
+
+        Potency and the set of still-potent clusters are kept as running values.
+        A component's deficit is the number of live clusters it cannot be (its
+        own clusters included), so it is potent while its deficit is below the
+        number of live clusters, and graph potency is
+            live^2 - sum(|C|^2) - 2 * sum(|C||D| for every cannot-link edge C-D).
+        Every decision only re-files the components it touches.
+
+        Between `defer_bookkeeping` and `resume_bookkeeping` decisions only update
+        the components and cannot-links, and the running values are rebuilt once
+        at the end, which is much cheaper when applying many decisions in bulk.
+        Potency and the potent clusters are stale in between, and components whose
+        clusters were all discarded are only dropped at the end.
+
+        A component with few candidates among many potent clusters gets an index of
+        the components it could still be, built the first time one is picked for it
+        and kept up to date by every decision after, so picking stays proportional
+        to the candidates.
+    """
+    def __init__(self, num_clusters):
+        self.parent = list(range(num_clusters))
+        self.members = {id: set([id]) for id in range(num_clusters)} # root -> live cluster ids in its component
+        self.cant = {id: set() for id in range(num_clusters)} # root -> roots it cannot be
+        self.live = IndexedSet(range(num_clusters)) # ids of clusters that still exist
+
+        self.cant_size = {id: 0 for id in range(num_clusters)} # root -> number of clusters it cannot be
+        self.deficit = {id: 1 for id in range(num_clusters)} # root -> cant_size + component size
+        self.by_deficit = {1: set(range(num_clusters))} if num_clusters > 0 else dict() # deficit -> roots
+
+        self.square_sum = num_clusters # sum of squared component sizes
+        self.cross_sum = 0 # sum of |C||D| over cannot-link edges
+
+        self.potent_roots = set(range(num_clusters)) if num_clusters > 1 else set()
+        self.potent = IndexedSet(self.potent_roots) # ids of live clusters that could still be another cluster
+
+        self.candidates = dict() # indexed root -> roots it could still be
+        self.indexed_by = dict() # root -> indexed roots that could still be it
+
+        self.deferred = False
+
+    def find(self, id):
+        """
+            Returns the root id of the component holding cluster `id`.
+        """
+        parent = self.parent
+
+        root = id
+        while parent[root] != root:
+            root = parent[root]
+
+        while parent[id] != root:
+            parent[id], id = root, parent[id]
+
+        return root
+
+    def add(self):
+        """
+            Adds a new cluster that could be any other cluster and returns its id.
+        """
+        id = len(self.parent)
+
+        self.parent.append(id)
+        self.members[id] = set([id])
+        self.cant[id] = set()
+        self.cant_size[id] = 0
+        self.live.add(id)
+
+        if self.deferred: return id
+
+        self.square_sum += 1
+
+        if len(self.candidates) > 0:
+            for root in self.candidates:
+                self.candidates[root].add(id)
+            self.indexed_by[id] = set(self.candidates)
+
+        # the new cluster is a candidate for every component, so none stay saturated
+        for root in list(self.by_deficit.get(len(self.live) - 1, ())):
+            self._refresh_status(root)
+
+        self._update(id)
+
+        return id
+
+    def discard(self, id):
+        """
+            Removes cluster `id` (e.g. once it has no nodes left) from every decision it is part of.
+        """
+        if id not in self.live: return
+
+        root = self.find(id)
+        size = len(self.members[root])
+
+        self.live.remove(id)
+        self.members[root].remove(id)
+
+        # an emptied component is kept until `resume_bookkeeping`, so it can still be linked
+        if self.deferred: return
+
+        self.potent.discard(id)
+
+        self.square_sum -= 2 * size - 1
+        self.cross_sum -= self.cant_size[root]
+
+        neighbors = list(self.cant[root])
+        for other in neighbors:
+            self.cant_size[other] -= 1
+
+        if size == 1: # the whole component is gone
+            self._unindex(root)
+            for other in self.indexed_by.pop(root, ()):
+                self.candidates[other].remove(root)
+
+            for other in self.cant.pop(root):
+                self.cant[other].remove(root)
+            del self.members[root]
+            del self.cant_size[root]
+            self._unfile(root, self.deficit.pop(root))
+            self.potent_roots.discard(root)
+        else:
+            self._update(root)
+
+        for other in neighbors:
+            self._update(other)
+
+        # components whose only candidate was `id` are now saturated
+        for other in list(self.by_deficit.get(len(self.live), ())):
+            self._refresh_status(other)
+
+    def must_link(self, id1, id2):
+        """
+            Records that clusters `id1` and `id2` are the same cluster.
+        """
+        if self.deferred:
+            self.link_all([(id1, id2)], ())
+            return
+
+        root1, root2 = self.find(id1), self.find(id2)
+        if root1 == root2: return
+
+        if len(self.members[root1]) < len(self.members[root2]):
+            root1, root2 = root2, root1
+
+        size1, size2 = len(self.members[root1]), len(self.members[root2])
+        was_potent1, was_potent2 = root1 in self.potent_roots, root2 in self.potent_roots
+
+        self._merge_index(root1, root2)
+
+        cant1, cant2 = self.cant[root1], self.cant.pop(root2)
+
+        if root2 in cant1: # contradicts an earlier decision, which the merge overrules
+            cant1.remove(root2)
+            cant2.remove(root1)
+            self.cross_sum -= size1 * size2
+
+        # everything either side cannot be, the merged component cannot be either
+        only_cant1 = cant1.difference(cant2)
+
+        for other in cant2:
+            self.cant[other].remove(root2)
+            if other not in cant1:
+                self.cant[other].add(root1)
+                cant1.add(other)
+                self.cant_size[other] += size1
+                self.cross_sum += size1 * len(self.members[other])
+                self._update(other)
+
+        for other in only_cant1:
+            self.cant_size[other] += size2
+            self.cross_sum += size2 * len(self.members[other])
+            self._update(other)
+
+        self.parent[root2] = root1
+        self.square_sum += 2 * size1 * size2
+
+        members2 = self.members.pop(root2)
+        self.members[root1].update(members2)
+        self.cant_size[root1] = sum(len(self.members[other]) for other in cant1)
+        del self.cant_size[root2]
+
+        self._unfile(root2, self.deficit.pop(root2))
+        self.potent_roots.discard(root2)
+
+        # bring the absorbed clusters in line with root1 before re-filing the whole component
+        if was_potent1 and not was_potent2:
+            self.potent.update(members2)
+        elif was_potent2 and not was_potent1:
+            self.potent.difference_update(members2)
+
+        self._update(root1)
+
+    def cannot_link(self, id1, id2):
+        """
+            Records that clusters `id1` and `id2` are different clusters.
+        """
+        if self.deferred:
+            self.link_all((), [(id1, id2)])
+            return
+
+        root1, root2 = self.find(id1), self.find(id2)
+        if root1 == root2 or root2 in self.cant[root1]: return
+
+        self.cant[root1].add(root2)
+        self.cant[root2].add(root1)
+
+        self._drop_candidate(root1, root2)
+        self._drop_candidate(root2, root1)
+
+        size1, size2 = len(self.members[root1]), len(self.members[root2])
+        self.cant_size[root1] += size2
+        self.cant_size[root2] += size1
+        self.cross_sum += size1 * size2
+
+        self._update(root1)
+        self._update(root2)
+
+    def link_all(self, must_links, cannot_links):
+        """
+            Records many decisions at once: that the clusters of every (id1, id2) pair in
+            `must_links` are the same cluster, and those of every pair in `cannot_links` are not.
+
+            A must-link overrules a cannot-link between the same components whichever came
+            first, so this ends up where making the decisions in their original order would.
+            Making every must-link first means no cannot-link is carried over in a merge.
+        """
+        deferred, self.deferred = self.deferred, True
+        find, parent, members, cant = self.find, self.parent, self.members, self.cant
+
+        for id1, id2 in must_links:
+            root1, root2 = find(id1), find(id2)
+            if root1 == root2: continue
+
+            if len(members[root1]) < len(members[root2]):
+                root1, root2 = root2, root1
+
+            # the merged component cannot be anything either side could not be
+            cant1, cant2 = cant[root1], cant.pop(root2)
+            cant1.discard(root2)
+            cant2.discard(root1)
+            for other in cant2:
+                cant[other].remove(root2)
+                cant[other].add(root1)
+            cant1.update(cant2)
+
+            parent[root2] = root1
+            members[root1].update(members.pop(root2))
+
+        for id1, id2 in cannot_links:
+            root1, root2 = find(id1), find(id2)
+            if root1 != root2:
+                cant[root1].add(root2)
+                cant[root2].add(root1)
+
+        if not deferred:
+            self.resume_bookkeeping()
+
+    def defer_bookkeeping(self):
+        """
+            Stops keeping potency and the potent clusters up to date until `resume_bookkeeping`.
+        """
+        self.deferred = True
+
+    def resume_bookkeeping(self):
+        """
+            Rebuilds potency and the potent clusters from the components and cannot-links.
+        """
+        self.deferred = False
+
+        # the decisions made in between did not keep the candidate indexes up to date
+        self.candidates, self.indexed_by = dict(), dict()
+
+        for root in [root for root, component in self.members.items() if len(component) == 0]:
+            for other in self.cant.pop(root):
+                self.cant[other].remove(root)
+            del self.members[root]
+
+        members, live = self.members, len(self.live)
+        sizes = {root: len(component) for root, component in members.items()}
+
+        self.cant_size = {root: sum(map(sizes.__getitem__, cant)) for root, cant in self.cant.items()}
+        self.deficit = {root: size + self.cant_size[root] for root, size in sizes.items()}
+
+        self.by_deficit = dict()
+        for root, deficit in self.deficit.items():
+            self.by_deficit.setdefault(deficit, set()).add(root)
+
+        self.square_sum = sum(size * size for size in sizes.values())
+        self.cross_sum = sum(size * self.cant_size[root] for root, size in sizes.items()) // 2
+
+        self.potent_roots = {root for root, deficit in self.deficit.items() if deficit < live}
+        self.potent = IndexedSet(id for root in self.potent_roots for id in members[root])
+
+    def is_same(self, id):
+        return self.members[self.find(id)]
+
+    def cant_be(self, id):
+        cant_be = set()
+        for other in self.cant[self.find(id)]:
+            cant_be.update(self.members[other])
+        return cant_be
+
+    def could_be(self, id1, id2):
+        """
+            Returns True if live clusters `id1` and `id2` could still be the same cluster, else False.
+        """
+        if id1 not in self.live or id2 not in self.live: return False
+
+        root1, root2 = self.find(id1), self.find(id2)
+        return root1 != root2 and root2 not in self.cant[root1]
+
+    def can_be(self, id):
+        root = self.find(id)
+        cant = self.cant[root]
+        return set(other for other in self.live if self.find(other) != root and self.find(other) not in cant)
+
+    def choose_can_be(self, id, tries=32):
+        """
+            Returns a uniformly random cluster id that cluster `id` could still be, or None.
+
+            Takes O(tries) expected time, or otherwise time proportional to the candidates
+            once the component of `id` is indexed.
+        """
+        num_can_be = self.num_can_be(id)
+        if num_can_be <= 0: return None
+
+        root = self.find(id)
+        cant = self.cant[root]
+        potent = self.potent
+
+        # every candidate is potent, so a random potent cluster is one with probability
+        # num_can_be / len(potent); rejection sampling is used while that takes few tries
+        if num_can_be * tries >= len(potent):
+            self._unindex(root) # no longer needed, and every new cluster would grow it
+
+            while True:
+                other = potent.choice()
+                other_root = self.find(other)
+                if other_root != root and other_root not in cant:
+                    return other
+
+        # otherwise pick a candidate component weighted by its size, then a cluster in it
+        if root not in self.candidates:
+            self._index(root)
+
+        target = random.randrange(num_can_be)
+        for other_root in self.candidates[root]:
+            members = self.members[other_root]
+            if target < len(members):
+                return next(islice(members, target, None))
+            target -= len(members)
+
+    def num_can_be(self, id):
+        """
+            The number of clusters that cluster `id` could still be, without building the set.
+        """
+        if id not in self.live: return 0
+
+        return len(self.live) - self.deficit[self.find(id)]
+
+    def potency(self):
+        """
+            The sum over every live cluster of the number of clusters it could still be.
+        """
+        return len(self.live) ** 2 - self.square_sum - 2 * self.cross_sum
+
+    def _index(self, root):
+        # candidates are potent, so only the potent components are walked, once
+        cant = self.cant[root]
+        candidates = self.candidates[root] = set(other for other in self.potent_roots if other != root and other not in cant)
+
+        for other in candidates:
+            self.indexed_by.setdefault(other, set()).add(root)
+
+    def _unindex(self, root):
+        for other in self.candidates.pop(root, ()):
+            self.indexed_by[other].remove(root)
+
+    def _drop_candidate(self, root, other):
+        if root in self.candidates:
+            self.candidates[root].remove(other)
+            self.indexed_by[other].remove(root)
+
+    def _merge_index(self, root1, root2):
+        """
+            Brings the candidate indexes in line with `root2` being merged into `root1`,
+            before their cannot-links are.
+        """
+        candidates, indexed_by = self.candidates, self.indexed_by
+
+        # the merged component can be what both sides could be
+        if root1 in candidates and root2 in candidates:
+            merged = candidates[root1] & candidates[root2]
+        elif root1 in candidates:
+            merged = candidates[root1].difference(self.cant[root2])
+        elif root2 in candidates:
+            merged = candidates[root2].difference(self.cant[root1])
+        else:
+            merged = None
+
+        self._unindex(root1)
+        self._unindex(root2)
+
+        # and an indexed component can be the merged one if it could be both sides
+        indexed1, indexed2 = indexed_by.pop(root1, set()), indexed_by.pop(root2, set())
+        for other in indexed2:
+            candidates[other].remove(root2)
+        for other in indexed1.difference(indexed2):
+            candidates[other].remove(root1)
+
+        indexed = indexed1 & indexed2
+        if len(indexed) > 0:
+            indexed_by[root1] = indexed
+
+        if merged is not None:
+            merged.discard(root1)
+            merged.discard(root2)
+            candidates[root1] = merged
+            for other in merged:
+                indexed_by.setdefault(other, set()).add(root1)
+
+    def _update(self, root):
+        """
+            Re-files `root` after its size or the size of what it cannot be changed.
+        """
+        old = self.deficit.get(root)
+        new = len(self.members[root]) + self.cant_size[root]
+
+        if old != new:
+            if old is not None: self._unfile(root, old)
+            self.deficit[root] = new
+            self.by_deficit.setdefault(new, set()).add(root)
+
+        self._refresh_status(root)
+
+    def _unfile(self, root, deficit):
+        bucket = self.by_deficit[deficit]
+        bucket.remove(root)
+        if len(bucket) == 0:
+            del self.by_deficit[deficit]
+
+    def _refresh_status(self, root):
+        potent = self.deficit[root] < len(self.live)
+        if potent == (root in self.potent_roots): return
+
+        if potent:
+            self.potent_roots.add(root)
+            self.potent.update(self.members[root])
+        else:
+            self.potent_roots.remove(root)
+            self.potent.difference_update(self.members[root])
 
 class MetaCluster:
-    def __init__(self, id, num_clusters):
+    """
+        A view of one cluster id in a `ConstraintStore`.
+    """
+    def __init__(self, id, constraints):
         self.id = id
-        self.is_same = set([id])
-        self.can_be = set([i for i in range(num_clusters)]).difference(self.is_same)
-        self.cant_be = set()
+        self.constraints = constraints
+
+    @property
+    def is_same(self):
+        return self.constraints.is_same(self.id)
+
+    @property
+    def can_be(self):
+        return self.constraints.can_be(self.id)
+
+    @property
+    def cant_be(self):
+        return self.constraints.cant_be(self.id)
 
     def add_cant(self, cluster):
-        idx = cluster.id
-        self.cant_be.update(cluster.is_same)
-        self.can_be.difference_update(self.cant_be)
+        self.constraints.cannot_link(self.id, cluster.id)
 
     def add_is(self, cluster):
-        idx = cluster.id
-        self.is_same.update(cluster.is_same)
-        self.cant_be.update(cluster.cant_be)
-        self.can_be.difference_update(self.cant_be.union(self.is_same))
+        self.constraints.must_link(self.id, cluster.id)
 
     def still_potent(self):
-        return len(self.can_be) > 0
+        return self.id in self.constraints.potent
 
 class ClusterWrapper:
-    def __init__(self, cg_metrics_wrapper):
+    def __init__(self, cg_metrics_wrapper, scheduler=None, snapshot_format='json', live_metrics=False):
         self.graph = cg_metrics_wrapper
-        self.clusters = self.graph.actual.get_clusters()
+        self.clusters = [IndexedSet(cluster) for cluster in self.graph.actual.get_clusters()]
 
         self.num_clusters = len(self.clusters)
 
-        self.meta_clusters = [MetaCluster(x, self.num_clusters) for x in range(self.num_clusters)] # seen clusters
+        self.constraints = ConstraintStore(self.num_clusters)
+        self.meta_clusters = [MetaCluster(x, self.constraints) for x in range(self.num_clusters)] # seen clusters
+
+        # decides which pair of clusters to ask about next
+        if scheduler is None:
+            scheduler = RandomScheduler()
+        self.scheduler = scheduler
+
+        # a `DecisionJournal` every decision is appended to, if any
+        self.journal = None
+
+        # 'json' or 'npz', the file format `save` writes
+        self.snapshot_format = snapshot_format
+
+        # the precision, recall, and fscore of the predicted clusters against the clusters joined so far, if kept
+        self.live_metrics = None
+        if live_metrics:
+            self._start_live_metrics()
+
+    def _start_live_metrics(self):
+        self.predicted_label_of, predicted_sizes = predicted_label_lookup(self.graph.actual, self.graph.predicted)
+        self.live_metrics = IncrementalMetrics(predicted_sizes)
 
+        for id, cluster in enumerate(self.clusters):
+            self.live_metrics.add(self.constraints.find(id), [self.predicted_label_of(vertex) for vertex in cluster])
+
+    @instrument.timed('cw.set_potency')
     def set_potency(self):
-        pluripotent = [x for x in self.meta_clusters if x.still_potent()]
-        self.potency,_ = sum([len(x.can_be) for x in pluripotent]), len(pluripotent)
+        self.potency = self.constraints.potency()
 
+    @instrument.timed('cw.suggest_pairing')
     def suggest_pairing(self):
         """
             Returns a tuple of two cluster IDs if a pairing is available, else False
         """
-        pluripotent = [x for x in self.meta_clusters if x.still_potent()]
+        self.potency = self.constraints.potency()
 
-        self.potency,_ = sum([len(x.can_be) for x in pluripotent]), len(pluripotent)
-            
-        if len(pluripotent) == 0: return False
+        pairing = self.scheduler.suggest(self)
+        if pairing is False: return False
 
-        metacluster_one = random.choice(pluripotent)
-        metacluster_two = self.meta_clusters[random.choice(list(metacluster_one.can_be))]
+        id1, id2 = pairing
 
-        return metacluster_one,metacluster_two
+        return self.meta_clusters[id1],self.meta_clusters[id2]
 
     def suggest_intra_pairing(self):
         """
             Returns a tuple of cluster IDs, where both are the same.
         """
 
-        cluster = random.choice(list(self.meta_clusters))
+        cluster = self.meta_clusters[self.constraints.live.choice()]
 
         return cluster,cluster
 
     def get_node_name_from_cluster(self, meta_cluster):
-        return random.choice(list(self.clusters[meta_cluster.id])).name
+        return self.clusters[meta_cluster.id].choice().name
+
+    def pairing_open(self, mc1, mc2):
+        """
+            Returns True if `mc1` and `mc2` could still be the same cluster (or, if they are
+            the same, if `mc1` still has images to check itself on), else False.
+        """
+        if mc1 is mc2: return mc1.id in self.constraints.live
+        return self.constraints.could_be(mc1.id, mc2.id)
+
+    def still_open(self, mc1, mc2, image1, image2):
+        """
+            Returns True if asking whether `image1` (from `mc1`) and `image2` (from `mc2`)
+            belong together has not been settled by a decision made since it was drawn, else False.
+        """
+        if not self.pairing_open(mc1, mc2): return False
+
+        node1 = self.graph.get_actual_vertex(image1)
+        node2 = self.graph.get_actual_vertex(image2)
+
+        return node1 in self.clusters[mc1.id] and node2 in self.clusters[mc2.id]
 
     def is_good_pairing(self, mc1, mc2, callback=None):
-        mc1.add_is(mc2)
-        mc2.add_is(mc1)
+        with instrument.stage('cw.is_good_pairing'):
+            self._record_pairing('G', mc1, mc2)
 
-        for same in mc1.is_same:
-            self.meta_clusters[same].add_is(mc2)
+            roots = self.constraints.find(mc1.id), self.constraints.find(mc2.id)
+            self.constraints.must_link(mc1.id, mc2.id)
 
-        for same in mc2.is_same:
-            self.meta_clusters[same].add_is(mc1)
+            if self.live_metrics is not None and roots[0] != roots[1]:
+                root = self.constraints.find(mc1.id)
+                self.live_metrics.merge(root, roots[1] if root == roots[0] else roots[0])
 
         if callback is not None:
             callback()
 
     def is_bad_pairing(self, mc1, mc2, callback=None):
-        mc1.add_cant(mc2)
-        mc2.add_cant(mc1)
-
-        for same in mc1.is_same:
-            self.meta_clusters[same].add_cant(mc2)
-
-        for same in mc2.is_same:
-            self.meta_clusters[same].add_cant(mc1)
+        with instrument.stage('cw.is_bad_pairing'):
+            self._record_pairing('B', mc1, mc2)
+            self.constraints.cannot_link(mc1.id, mc2.id)
 
         if callback is not None:
             callback()
 
     def problem_with_cluster(self, cluster, image1, image2, callback=None):
-        act_cluster = self.clusters[cluster.id]
+        with instrument.stage('cw.problem_with_cluster'):
+            act_cluster = self.clusters[cluster.id]
 
-        if len(act_cluster) != 1: # if the length is one, there can be no problems
-            node1 = self.graph.get_actual_vertex(image1)
-            node2 = self.graph.get_actual_vertex(image2)
+            if len(act_cluster) != 1: # if the length is one, there can be no problems
+                if self.journal is not None:
+                    self.journal.record('P', image1, image2)
 
-            act_cluster.remove(node1)
-            if node2 in act_cluster: act_cluster.remove(node2) # just in case we check the same image?
+                node1 = self.graph.get_actual_vertex(image1)
+                node2 = self.graph.get_actual_vertex(image2)
 
-            self._isolate_node_create_metacluster(node1)
-            if node2 != node1: self._isolate_node_create_metacluster(node2) # just in case we check the same image?
+                act_cluster.remove(node1)
+                if node2 in act_cluster: act_cluster.remove(node2) # just in case we check the same image?
 
-        if callback is not None:
-            callback()
-
-    def _isolate_node_create_metacluster(self, node):
-        node.isolate()
-
-        num_clusters = len(self.meta_clusters)
+                self._isolate_node_create_metacluster(node1, cluster.id)
+                if node2 != node1: self._isolate_node_create_metacluster(node2, cluster.id) # just in case we check the same image?
 
-        self.clusters.append(set([node]))
+                # an emptied cluster keeps its id (and MetaCluster) as a tombstone, but drops out of every decision
+                if len(act_cluster) == 0:
+                    self.constraints.discard(cluster.id)
 
-        for mc in self.meta_clusters:
-            mc.can_be.add(num_clusters)
+        if callback is not None:
+            callback()
 
-        self.meta_clusters.append(MetaCluster(num_clusters, num_clusters + 1))
+    def _record_pairing(self, kind, mc1, mc2):
+        # any node names its cluster, as long as decisions are replayed in order
+        if self.journal is not None:
+            self.journal.record(kind, self.clusters[mc1.id][0].name, self.clusters[mc2.id][0].name)
 
-        self._clean_meta_clusters(self)
+    def _isolate_node_create_metacluster(self, node, old_id):
+        node.isolate()
 
-    def _clean_meta_clusters(self, id):
-        for i,c in enumerate(self.clusters):
-            if len(c) == 0:
-                to_rem = None
-                for mc in self.meta_clusters:
-                    if mc.id == i:
-                        print('going to remove {}'.format(mc.id))
-                        to_rem = mc
+        self.clusters.append(IndexedSet([node]))
 
-                    if i in mc.can_be: mc.can_be.remove(i)
-                    if i in mc.cant_be: mc.cant_be.remove(i)
-                    if i in mc.is_same: mc.is_same.remove(i)
-                if to_rem is not None: self.meta_clusters.remove(mc)
+        # the new cluster could be any other cluster
+        id = self.constraints.add()
+        self.meta_clusters.append(MetaCluster(id, self.constraints))
 
+        if self.live_metrics is not None:
+            label = self.predicted_label_of(node)
+            self.live_metrics.remove(self.constraints.find(old_id), label)
+            self.live_metrics.add(id, [label])
 
+    @instrument.timed('cw.update_graph')
     def update_graph_and_return(self):
         for metacluster in self.meta_clusters:
             idx = metacluster.id
+            if idx not in self.constraints.live: continue
             random_node = random.choice(self.clusters[idx])
             for same in metacluster.is_same:
                 other_rand_node = random.choice(self.clusters[same])
@@ -267,7 +872,15 @@ class ClusterWrapper:
 
         return self.graph
 
+    @instrument.timed('cw.save')
     def save(self, timestamp=None):
         if timestamp is None:
             timestamp = get_timestamp_string()
-        self.graph.save_to_json_file('{}.json'.format(timestamp))
\ No newline at end of file
+
+        path = '{}.{}'.format(timestamp, self.snapshot_format)
+        if self.snapshot_format == 'npz':
+            self.graph.save_to_snapshot(path)
+        else:
+            self.graph.save_to_json_file(path)
+
+        return path
\ No newline at end of file
@@ -0,0 +1,82 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from PIL import Image
+import instrument
+
+class ImagePrefetcher:
+    """
+        Decodes and resizes images on a thread pool ahead of time.
+
+        Results are kept in a bounded LRU cache of futures keyed by path, so
+        asking for an image that was prefetched only waits for whatever decoding
+        is still left. Only PIL images are produced here; turning them into Tk
+        images must still happen on the Tk thread.
+
+        If a `ThumbnailStore` with pair-view thumbnails of the same size is given,
+        images in it are copied out of the store instead of being decoded.
+    """
+
+    def __init__(self, size, capacity=32, workers=4, thumbnails=None):
+        self.size = tuple(size)
+        self.capacity = capacity
+
+        if thumbnails is not None and thumbnails.sizes.get('pair') != self.size:
+            thumbnails = None
+        self.thumbnails = thumbnails
+
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.cache = OrderedDict() # path -> Future of the resized image
+
+    def prefetch(self, paths):
+        """
+            Starts decoding every path in `paths` that is not cached yet.
+        """
+        for path in paths:
+            self._future(path)
+
+    def get(self, path):
+        """
+            Returns the decoded and resized image at `path`, waiting for it if needed.
+        """
+        future = self._future(path)
+        instrument.count('images.ready' if future.done() else 'images.waited')
+
+        with instrument.stage('images.wait'):
+            return future.result()
+
+    def shutdown(self):
+        # cancels whatever has not started yet, like `cancel_futures` of Python 3.9+ would
+        with self.lock:
+            for future in self.cache.values():
+                future.cancel()
+            self.cache.clear()
+
+        self.executor.shutdown(wait=False)
+
+    def _future(self, path):
+        with self.lock:
+            future = self.cache.get(path)
+
+            if future is None:
+                future = self.executor.submit(self._load, path)
+                self.cache[path] = future
+
+                # an evicted image is not decoded if it has not started yet
+                if len(self.cache) > self.capacity:
+                    self.cache.popitem(last=False)[1].cancel()
+            else:
+                self.cache.move_to_end(path)
+
+        return future
+
+    @instrument.timed('images.decode')
+    def _load(self, path):
+        if self.thumbnails is not None:
+            thumbnail = self.thumbnails.pair(path)
+            if thumbnail is not None:
+                return Image.fromarray(thumbnail)
+
+        with Image.open(path) as image:
+            return image.resize(self.size)
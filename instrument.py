@@ -0,0 +1,250 @@
+import json
+import time
+import threading
+import tracemalloc
+from functools import wraps
+
+# Opt-in timers and counters for a labelling session.
+#
+# Nothing is recorded until `enable` is called; until then a `timed` function
+# costs one extra global lookup per call. Stages are named '<area>.<operation>',
+# e.g. 'cw.suggest_pairing' or 'display.render_question'.
+
+class Profiler:
+    """
+        Collects how long every stage took each time it ran, event counters, and
+        how long the annotator took to answer each question (time-to-answer).
+
+        Time-to-answer runs from `shown` (the question is on screen) to `answered`
+        (the click), so it is human think time, while the stages are the time the
+        program kept the annotator waiting.
+
+        If `track_memory` is set, the peak memory traced by `tracemalloc` above
+        what was allocated when a stage started is kept per stage as well, which
+        slows everything down considerably. The peak is process-wide, so only
+        stages on the main thread record one (including whatever other threads
+        allocated meanwhile); on Python 3.8, which cannot reset the peak, the
+        memory still allocated when a stage ends is recorded instead.
+    """
+
+    def __init__(self, track_memory=False):
+        self.track_memory = track_memory
+        self.started = time.time()
+
+        self.timings = dict() # stage -> [seconds, ...]
+        self.peaks = dict() # stage -> largest peak in bytes
+        self.counters = dict() # counter -> count
+        self.answers = dict() # kind of question -> [seconds, ...]
+
+        self.shown_at = None # (kind, perf_counter) of the question on screen
+        self.stack = [] # [traced at the start, highest peak so far] of the running main-thread stages
+
+        if track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def shown(self, kind):
+        self.shown_at = kind, time.perf_counter()
+
+    def answered(self):
+        if self.shown_at is None: return
+
+        kind, shown_at = self.shown_at
+        self.answers.setdefault(kind, []).append(time.perf_counter() - shown_at)
+        self.shown_at = None
+
+    def summary(self):
+        """
+            Returns the session profile as a json-serializable dict.
+        """
+        stages = dict()
+        for name, seconds in self.timings.items():
+            stages[name] = _distribution(seconds)
+            if name in self.peaks:
+                stages[name]['peak_bytes'] = self.peaks[name]
+
+        return {
+            'started': self.started,
+            'duration': time.time() - self.started,
+            'stages': stages,
+            'counters': dict(self.counters),
+            'time_to_answer': {kind: _distribution(seconds) for kind, seconds in self.answers.items()}
+        }
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=4)
+
+    def report(self):
+        """
+            Returns the session profile as a human-readable table.
+        """
+        summary = self.summary()
+        lines = ['{:<32} {:>7} {:>10} {:>10} {:>10} {:>10} {:>10}'.format('stage', 'calls', 'total', 'p50', 'p90', 'p99', 'peak')]
+
+        for name, stats in sorted(summary['stages'].items(), key=lambda item: -item[1]['total']):
+            peak = _format_bytes(stats['peak_bytes']) if 'peak_bytes' in stats else '-'
+            lines.append('{:<32} {:>7} {:>9.3f}s {:>9.1f}ms {:>9.1f}ms {:>9.1f}ms {:>10}'.format(
+                name, stats['count'], stats['total'], stats['p50'] * 1000, stats['p90'] * 1000, stats['p99'] * 1000, peak))
+
+        for kind, stats in sorted(summary['time_to_answer'].items()):
+            lines.append('time to answer ({}): {} answers, median {:.2f}s, p90 {:.2f}s'.format(kind, stats['count'], stats['p50'], stats['p90']))
+
+        for name, count in sorted(summary['counters'].items()):
+            lines.append('{}: {}'.format(name, count))
+
+        return '\n'.join(lines)
+
+class _Stage:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        profiler = self.profiler
+        self.tracked = profiler.track_memory and threading.current_thread() is threading.main_thread()
+
+        if self.tracked:
+            stack = profiler.stack
+
+            # tracemalloc keeps a single peak, so the enclosing stage keeps what it saw so far
+            current, peak = _traced_memory()
+            if len(stack) > 0:
+                stack[-1][1] = max(stack[-1][1], peak)
+            if _CAN_RESET_PEAK:
+                tracemalloc.reset_peak() # novermin: only where it exists
+
+            stack.append([current, current]) # [traced at the start, highest peak so far]
+
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        profiler = self.profiler
+
+        profiler.timings.setdefault(self.name, []).append(elapsed)
+
+        if self.tracked:
+            stack = profiler.stack
+            start, floor = stack.pop()
+            peak = max(floor, _traced_memory()[1])
+
+            profiler.peaks[self.name] = max(profiler.peaks.get(self.name, 0), peak - start)
+            if len(stack) > 0:
+                stack[-1][1] = max(stack[-1][1], peak)
+
+        return False
+
+_CAN_RESET_PEAK = hasattr(tracemalloc, 'reset_peak') # Python 3.9+
+
+def _traced_memory():
+    # (traced now, peak since the last reset), where the peak is only known if it can be reset
+    current, peak = tracemalloc.get_traced_memory()
+    return current, peak if _CAN_RESET_PEAK else current
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+_profiler = None
+
+def enable(track_memory=False):
+    """
+        Starts recording into a new `Profiler`, which is returned.
+    """
+    global _profiler
+    _profiler = Profiler(track_memory=track_memory)
+    return _profiler
+
+def disable():
+    """
+        Stops recording and returns the `Profiler` that was recording, if any.
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+
+    if profiler is not None and profiler.track_memory:
+        tracemalloc.stop()
+
+    return profiler
+
+def active():
+    return _profiler
+
+def stage(name):
+    """
+        Returns a context manager timing its body as `name`, which does nothing while disabled.
+    """
+    return _NULL_STAGE if _profiler is None else _profiler.stage(name)
+
+def timed(name):
+    """
+        Decorates a function so every call is timed as stage `name`.
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return function(*args, **kwargs)
+
+            with _profiler.stage(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+def count(name, n=1):
+    if _profiler is not None:
+        _profiler.count(name, n)
+
+def shown(kind):
+    """
+        Marks that a question of `kind` (e.g. 'pair') is now on screen, waiting for the annotator.
+    """
+    if _profiler is not None:
+        _profiler.shown(kind)
+
+def answered():
+    """
+        Marks that the annotator answered the question on screen.
+    """
+    if _profiler is not None:
+        _profiler.answered()
+
+def _format_bytes(n):
+    if n < 2**20:
+        return '{:.1f}KB'.format(n / 2**10)
+    return '{:.1f}MB'.format(n / 2**20)
+
+def _distribution(values):
+    ordered = sorted(values)
+
+    return {
+        'count': len(ordered),
+        'total': sum(ordered),
+        'mean': sum(ordered) / len(ordered),
+        'p50': _percentile(ordered, 50),
+        'p90': _percentile(ordered, 90),
+        'p99': _percentile(ordered, 99),
+        'max': ordered[-1]
+    }
+
+def _percentile(ordered, q):
+    # linear interpolation between the closest ranks of a sorted list
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
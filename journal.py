@@ -0,0 +1,186 @@
+import os
+import time
+import zlib
+import hashlib
+import instrument
+from itertools import chain
+
+class DecisionJournal:
+    """
+        An append-only log of the decisions made on a `ClusterWrapper`, so a
+        crashed or killed session can be restored by replaying it.
+
+        Every decision is one tab-separated line naming two images, which
+        identify the clusters involved independently of cluster ids:
+            G <image1> <image2> : is_good_pairing of the clusters holding the images
+            B <image1> <image2> : is_bad_pairing of the clusters holding the images
+            P <image1> <image2> : problem_with_cluster on the two images
+
+        The first line, '# <fingerprint>', is a digest of which images were clustered
+        together when the journal was started. `replay` refuses a journal of
+        other clusters, and learns the fingerprint for a new journal, so it is
+        called before the first decision is recorded.
+
+        Lines are handed to the OS as soon as they are written, so they survive
+        the process dying; they are fsynced every `sync_every` decisions or
+        `sync_interval` seconds, whichever comes first.
+    """
+
+    def __init__(self, path, sync_every=32, sync_interval=2.0):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+
+        self.fingerprint = None # of the clusters the journal belongs to, once known
+
+        self.file = None
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def record(self, kind, image1, image2):
+        if self.file is None:
+            directory = os.path.dirname(self.path)
+            if directory != '':
+                os.makedirs(directory, exist_ok=True)
+            self.file = open(self.path, 'a')
+
+            if self.file.tell() == 0 and self.fingerprint is not None:
+                self.file.write('# {}\n'.format(self.fingerprint))
+
+            # finish a line cut short by a crash, so it cannot swallow the next decision
+            elif self.file.tell() > 0:
+                with open(self.path, 'rb') as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        self.file.write('\n')
+
+        self.file.write('{}\t{}\t{}\n'.format(kind, image1, image2))
+        self.file.flush()
+
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        if self.file is None: return
+
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        self.sync()
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def set_aside(self):
+        """
+            Renames the journal file out of the way, so a new one is started, and returns its new path.
+        """
+        self.close()
+
+        path = '{}.{}'.format(self.path, time.strftime('%Y%m%d-%H%M%S'))
+        os.replace(self.path, path)
+
+        return path
+
+    @instrument.timed('journal.replay')
+    def replay(self, cluster_wrapper):
+        """
+            Applies every decision in the journal to `cluster_wrapper` and returns how many were applied.
+
+            Raises a ValueError, before applying anything, if the journal was written
+            for clusters other than those `cluster_wrapper` started from.
+
+            Decisions that no longer make sense are skipped: those naming images that
+            `cluster_wrapper` does not know (e.g. from an older version of the dataset),
+            and problems with two images that are not in one cluster. A pairing is with
+            the clusters that held its images when it was made, which were live then.
+            Pairings go straight to the constraints in one batch, with potency rebuilt
+            once at the end.
+        """
+        cluster_of, self.fingerprint = _index_clusters(cluster_wrapper.clusters)
+
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return 0
+
+        with open(self.path, 'r') as f:
+            header = f.readline().rstrip('\n')
+            if header != '# {}'.format(self.fingerprint):
+                raise ValueError('{} was written for other clusters'.format(self.path))
+
+            # a line cut short by a crash lacks a field
+            lines = f.read().split('\n')
+            fields = '\t'.join(line for line in lines if line.count('\t') == 2).split('\t')
+
+        kinds, images1, images2 = fields[0::3], fields[1::3], fields[2::3]
+        ids1, ids2 = list(map(cluster_of.get, images1)), list(map(cluster_of.get, images2))
+
+        cw = cluster_wrapper
+        journal, cw.journal = cw.journal, None
+
+        # pairings are linked all at once at the end; only problems change which cluster holds an image
+        cw.constraints.defer_bookkeeping()
+
+        # an image moves at most once, as the problem splits it off into a cluster of its own
+        moved = dict() # image -> (line it moved at, its new cluster)
+        num_problems = 0
+
+        for line in [line for line, kind in enumerate(kinds) if kind == 'P']:
+            image1, image2 = images1[line], images2[line]
+            id1 = cluster_of.get(image1)
+            if id1 is None or id1 != cluster_of.get(image2): continue
+
+            num_clusters = len(cw.clusters)
+            cw.problem_with_cluster(cw.meta_clusters[id1], image1, image2)
+            num_problems += 1
+
+            for id in range(num_clusters, len(cw.clusters)):
+                for vertex in cw.clusters[id]:
+                    cluster_of[vertex.name] = id
+                    moved[vertex.name] = (line, id)
+
+        # a pairing made after one of its images moved is with the image's new cluster
+        for ids, images in ((ids1, images1), (ids2, images2)):
+            for line in [line for line, image in enumerate(images) if image in moved]:
+                moved_at, id = moved[images[line]]
+                if moved_at < line:
+                    ids[line] = id
+
+        # known images were in a live cluster at the time, as images leave a cluster before it empties
+        must_links = [(id1, id2) for kind, id1, id2 in zip(kinds, ids1, ids2) if kind == 'G' and id1 is not None and id2 is not None]
+        cannot_links = [(id1, id2) for kind, id1, id2 in zip(kinds, ids1, ids2) if kind == 'B' and id1 is not None and id2 is not None]
+
+        # only the components a must-link merges can end up under another root
+        merged = set(map(cw.constraints.find, chain.from_iterable(must_links))) if cw.live_metrics is not None else None
+
+        cw.constraints.link_all(must_links, cannot_links)
+        cw.constraints.resume_bookkeeping()
+        cw.set_potency()
+
+        if cw.live_metrics is not None:
+            cw.live_metrics.regroup(cw.constraints.find, merged)
+        cw.journal = journal
+
+        return num_problems + len(must_links) + len(cannot_links)
+
+def _index_clusters(clusters):
+    # returns ({name: index of its cluster}, fingerprint), where the fingerprint only
+    # depends on which names are clustered together, not on the order of either
+    import numpy as np
+
+    names = [vertex.name for cluster in clusters for vertex in cluster]
+    sizes = np.fromiter(map(len, clusters), dtype=np.int64, count=len(clusters))
+    cluster_of = dict(zip(names, np.repeat(np.arange(len(clusters)), sizes).tolist()))
+
+    # a cluster's digest is the sum of its scrambled name checksums, which ignores their order
+    checksums = np.fromiter(map(zlib.crc32, map(str.encode, names)), dtype=np.uint64, count=len(names))
+    scrambled = checksums * np.uint64(0x9E3779B97F4A7C15)
+    starts = np.cumsum(sizes) - sizes
+    digests = np.add.reduceat(scrambled, starts[sizes > 0]) if len(names) > 0 else scrambled
+
+    return cluster_of, hashlib.sha1(np.sort(digests).tobytes()).hexdigest()[:16]
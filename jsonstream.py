@@ -0,0 +1,121 @@
+import json
+import re
+
+# Streams the json cluster files of `NodeCGMW`:
+#     {"actual": {"0": [names...], "1": [...], ...}, "predicted": {...}}
+# one cluster at a time, so neither side holds more than a cluster in memory.
+
+def write_clusters(f, sections):
+    """
+        Writes `sections`, a list of (key, clusters) where `clusters` yields lists
+        of vertex names, to the file `f` as a json object of cluster objects.
+        Every cluster goes on a line of its own.
+    """
+    f.write('{')
+
+    for section_count, (key, clusters) in enumerate(sections):
+        f.write(',\n' if section_count > 0 else '\n')
+        f.write('    {}: {{'.format(json.dumps(key)))
+
+        for cluster_count, names in enumerate(clusters):
+            f.write(',' if cluster_count > 0 else '')
+            f.write('\n        "{}": {}'.format(cluster_count, json.dumps(names)))
+
+        f.write('\n    }')
+
+    f.write('\n}\n')
+
+def read_clusters(f, chunk_size=1 << 20):
+    """
+        Yields a (key, names) tuple for every cluster in a file written by `write_clusters`
+        (or by `json.dump` of the same structure), reading `f` a chunk at a time.
+    """
+    reader = _ChunkReader(f, chunk_size)
+
+    reader.expect('{')
+    if reader.peek() == '}': return
+
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        reader.expect('{')
+
+        if reader.peek() == '}': # no clusters
+            reader.next()
+        else:
+            while True:
+                reader.value() # the cluster's own key, which carries nothing
+                reader.expect(':')
+                yield key, reader.value()
+
+                if reader.next() == '}': break
+
+        if reader.next() == '}': break
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+class _ChunkReader:
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def peek(self):
+        """
+            Returns the next non-whitespace character without consuming it ('' at the end of the file).
+        """
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+
+            if self.pos < len(self.buffer) or not self._fill(self.chunk_size):
+                return self.buffer[self.pos:self.pos + 1]
+
+    def next(self):
+        """
+            Consumes and returns the next non-whitespace character, which must be ',' or a closing bracket.
+        """
+        c = self.peek()
+        if c not in (',', '}', ']'):
+            raise ValueError('Unexpected {!r} at offset {} of the cluster file'.format(c, self.pos))
+
+        self.pos += 1
+        return c
+
+    def expect(self, c):
+        if self.peek() != c:
+            raise ValueError('Expected {!r} at offset {} of the cluster file'.format(c, self.pos))
+        self.pos += 1
+
+    def value(self):
+        """
+            Decodes the next json value, reading more of the file until it is complete.
+        """
+        self.peek()
+
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+
+                # a number could still go on in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof: raise
+
+            # grow geometrically, so a value spanning many chunks is not decoded over and over
+            self._fill(max(self.chunk_size, len(self.buffer) - self.pos))
+
+    def _fill(self, size):
+        chunk = self.f.read(size)
+        if chunk == '':
+            self.eof = True
+            return False
+
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
@@ -1,52 +1,131 @@
+import os
 import sys
 import argparse
 from display import Display, MetaDisplay
-from supernodegraph import NodeCGMW, NodeCG
+from supernodegraph import NodeCGMW, GRAPH_CLASSES, convert_snapshot
 from graph import ClusterWrapper
+from scheduler import RandomScheduler, SimilarityScheduler
+from thumbnails import dataset_store
+from journal import DecisionJournal
+from manifest import dataset_manifest, dataset_name
+from graph import get_timestamp_string
+from metrics import format_report
+import instrument
+
+def resume(cluster_wrapper, mode, path):
+    """
+        Replays the decision journal of an earlier session of `mode` on the input at `path`,
+        if there is one, and journals every new decision to it.
+
+        A journal written for other clusters, e.g. as the input has changed since, is set aside.
+    """
+    key = '{}-{}'.format(mode, os.path.normpath(path).strip('/').replace('/', '_'))
+    journal = DecisionJournal('metadata/{}.journal'.format(key))
+
+    try:
+        num_replayed = journal.replay(cluster_wrapper)
+    except ValueError:
+        print('{} was written for other clusters; moved it to {} and started a new one'.format(journal.path, journal.set_aside()))
+        num_replayed = 0
+
+    if num_replayed > 0:
+        print('Restored {} decisions from {}'.format(num_replayed, journal.path))
+
+    cluster_wrapper.journal = journal
+
+def pair_scheduler(kind, name, thumbnails=None):
+    """
+        Returns the `PairScheduler` named `kind`, for the dataset named `name`.
+
+        The similarity scheduler keeps its image features in data/<name>.features.npz
+        between sessions, and takes them from the grid `thumbnails`, if there are any.
+    """
+    if kind == 'similarity':
+        return SimilarityScheduler(thumbnails=thumbnails, cache_path='data/{}.features.npz'.format(name))
+
+    return RandomScheduler()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='A cluster-dataset label-helper.')
-    parser.add_argument('mode', type=str, choices=['full', 'verify', 'meta'], help='The mode of this cluster-checker. Options are "full" (manually labelling an entire dataset from scratch), "verify" (verifying the accuracy of an existing dataset and then connecting clusters together), or "meta" (only connecting existing clusters together).')
-    parser.add_argument('filepath', type=str, help='relative path to a folder with only images or subfolders with only images inside (if mode is "full") or relative path to a folder of folders of images, where each subfolder represents a cluster and the images within it are nodes (if mode is "verify") or the relative path to a json file with the same structure as is generated from the first step of a "verify" run (if mode is "meta") -- see README for more details.')
+    parser.add_argument('mode', type=str, choices=['full', 'verify', 'meta', 'index', 'convert'], help='The mode of this cluster-checker. Options are "full" (manually labelling an entire dataset from scratch), "verify" (verifying the accuracy of an existing dataset and then connecting clusters together), "meta" (only connecting existing clusters together), "index" (prebuilding the thumbnails of a dataset so the GUI does not have to decode its images), or "convert" (converting a saved json file to a binary .npz snapshot or back).')
+    parser.add_argument('filepath', type=str, help='relative path to a folder with only images or subfolders with only images inside (if mode is "full") or relative path to a folder of folders of images, where each subfolder represents a cluster and the images within it are nodes (if mode is "verify") or the relative path to a json file with the same structure as is generated from the first step of a "verify" run (if mode is "meta", which also accepts a .npz snapshot) or the path to a .json or .npz file to convert (if mode is "convert") -- see README for more details.')
     parser.add_argument('--trust', type=int, choices=range(0,101), default=100, help='An integer between 0 and 100, where a lower number means we are more likely to check ourselves on existing clusters')
+    parser.add_argument('--scheduler', type=str, choices=['random', 'similarity'], default='random', help='How cluster pairings are chosen: "random" (uniformly at random) or "similarity" (visually similar clusters first).')
+    parser.add_argument('--format', type=str, choices=['json', 'npz'], default='json', help='The file format of the clusters saved when the meta-cluster checker is closed: "json" (human readable) or "npz" (a compact binary snapshot, for very large datasets).')
+    parser.add_argument('--graph', type=str, choices=sorted(GRAPH_CLASSES), default='node', help='How clusters are stored in memory: "node" (one object per image) or "array" (compact columnar arrays, for very large datasets).')
+    parser.add_argument('--pair-thumbnails', action='store_true', help='With "index", also store 600x600 thumbnails for the pair view (about 1MB per image), so showing a pair never decodes an image either.')
+    parser.add_argument('--profile', action='store_true', help='Time the loaders, decisions, and rendering, and how long each answer took, and write the profile to metadata/<timestamp>.profile.json when done.')
+    parser.add_argument('--profile-memory', action='store_true', help='Like --profile, but also record the peak memory of every stage (much slower).')
 
 
     args = parser.parse_args()
     option = args.mode
     dir_name = args.filepath
-    name = dir_name.split('/')[-1]
+    name = dataset_name(dir_name)
 
     trust = args.trust
+    graph_class = GRAPH_CLASSES[args.graph]
 
     print(name)
 
+    if args.profile or args.profile_memory:
+        instrument.enable(track_memory=args.profile_memory)
+
     if option == 'full':
         print('Launching brand-new cluster-labeller...')
-        cg = NodeCGMW()
-        cg.load_from_unorganized_folder(dir_name)
-        cw = ClusterWrapper(cg)
+        cg = NodeCGMW(graph_class=graph_class)
+        manifest = dataset_manifest(dir_name)
+        cg.load_from_unorganized_folder(dir_name, manifest=manifest)
+        thumbnails = dataset_store(dir_name, manifest=manifest)
+        cw = ClusterWrapper(cg, scheduler=pair_scheduler(args.scheduler, name, thumbnails), snapshot_format=args.format)
+        resume(cw, option, dir_name)
 
-        MetaDisplay(cw, trust=trust)
+        MetaDisplay(cw, trust=trust, thumbnails=thumbnails)
         
     elif option == 'verify':
         print('Launching intra-cluster checker...')
-        Display(dir_name)
+        manifest = dataset_manifest(dir_name)
+        Display(dir_name, manifest=manifest)
 
         print('Launching meta-cluster checker...')
-        cg = NodeCGMW()
-        cg.load_from_text_file('data/{}.txt'.format(name))
-        cw = ClusterWrapper(cg)
+        cg = NodeCGMW(graph_class=graph_class)
+        cg.load_from_text_file('data/{}.txt'.format(name), manifest=manifest)
+        thumbnails = dataset_store(dir_name, manifest=manifest)
+        cw = ClusterWrapper(cg, scheduler=pair_scheduler(args.scheduler, name, thumbnails), snapshot_format=args.format, live_metrics=True)
+        resume(cw, option, dir_name)
 
-        MetaDisplay(cw, trust=trust)
+        MetaDisplay(cw, trust=trust, thumbnails=thumbnails)
 
-        print('Metrics', cg.metrics())
+        print(format_report(cg.report()))
     elif option == 'meta':
         print('Launching meta-cluster checker...')
-        cg = NodeCGMW()
-        cg.load_from_json_file(dir_name)
-        cw = ClusterWrapper(cg)
+        cg = NodeCGMW(graph_class=graph_class)
+        if dir_name.endswith('.npz'):
+            cg.load_from_snapshot(dir_name)
+        else:
+            cg.load_from_json_file(dir_name)
+        cw = ClusterWrapper(cg, scheduler=pair_scheduler(args.scheduler, name), snapshot_format=args.format, live_metrics=True)
+        resume(cw, option, dir_name)
 
         MetaDisplay(cw, trust=trust)
 
-        print('Metrics', cg.metrics())
+        print(format_report(cg.report()))
+    elif option == 'index':
+        print('Indexing thumbnails...')
+        num_decoded = dataset_store(dir_name, pair_size=(600, 600) if args.pair_thumbnails else None, manifest=dataset_manifest(dir_name)).build(dir_name)
+
+        print('Decoded {} new or changed images'.format(num_decoded))
+    elif option == 'convert':
+        target = dir_name.rsplit('.', 1)[0] + ('.json' if dir_name.endswith('.npz') else '.npz')
+        convert_snapshot(dir_name, target, graph_class=graph_class)
+
+        print('Converted {} to {}'.format(dir_name, target))
+
+    profiler = instrument.disable()
+    if profiler is not None:
+        os.makedirs('metadata', exist_ok=True)
+        profile_path = 'metadata/{}.profile.json'.format(get_timestamp_string())
+        profiler.write(profile_path)
 
+        print(profiler.report())
+        print('Wrote profile to {}'.format(profile_path))
@@ -0,0 +1,153 @@
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+
+class DatasetManifest:
+    """
+        A persistent listing of every directory under a dataset's root.
+
+        For every directory it keeps the mtime it was listed at, its files (with
+        their size and mtime) and its subdirectories. `refresh` walks the tree
+        one level at a time on a thread pool, but only lists directories whose
+        mtime changed since they were last listed; the rest cost a single stat.
+        Since a directory's mtime only changes when entries are added, removed or
+        renamed, a file rewritten in place keeps its old size and mtime here.
+
+        Directories are keyed by their path built from `root` with '/', e.g.
+        'data/test/1' for subdirectory '1' of root 'data/test' (or 'data/test/';
+        paths are normalized first). A manifest with no `path` is only kept in memory.
+    """
+
+    def __init__(self, path, root):
+        self.path = path
+        self.root = os.path.normpath(root)
+
+        self.dirs = dict() # directory path -> [mtime in ns, {filename: [size, mtime in ns]}, [subdirectory names]]
+
+        if self.path is not None and os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                manifest = json.load(f)
+
+            if manifest['root'] == self.root:
+                self.dirs = manifest['dirs']
+
+    def files(self, directory):
+        """
+            Returns the names of the files directly in `directory`, or None if it is not in the manifest.
+        """
+        entry = self.dirs.get(os.path.normpath(directory))
+        if entry is None:
+            return None
+        return list(entry[1])
+
+    def subdirs(self, directory):
+        """
+            Returns the paths of the subdirectories directly in `directory`, or None if it is not in the manifest.
+        """
+        directory = os.path.normpath(directory)
+
+        entry = self.dirs.get(directory)
+        if entry is None:
+            return None
+        return ['{}/{}'.format(directory, name) for name in entry[2]]
+
+    def stamp(self, path):
+        """
+            Returns [size in bytes, mtime in ns] of the file at `path` as it was listed, or None if it is not in the manifest.
+        """
+        directory, _, filename = path.rpartition('/')
+
+        entry = self.dirs.get(os.path.normpath(directory))
+        if entry is None:
+            return None
+        return entry[1].get(filename)
+
+    def all_files(self):
+        """
+            Yields the path of every file under the root.
+        """
+        for directory, entry in self.dirs.items():
+            for filename in entry[1]:
+                yield '{}/{}'.format(directory, filename)
+
+    def refresh(self, workers=16, batch_size=64):
+        """
+            Brings the manifest up to date with the filesystem and returns the number of directories that were (re)listed or removed.
+        """
+        found = dict()
+        num_listed = 0
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            level = [self.root]
+
+            while len(level) > 0:
+                # directories are handed out in batches, as a task per directory costs more than a stat
+                batches = [level[i:i + batch_size] for i in range(0, len(level), batch_size)]
+                entries = chain.from_iterable(executor.map(self._scan, batches))
+
+                next_level = []
+                for directory, (entry, listed) in zip(level, entries):
+                    if entry is None: continue # removed while walking
+
+                    found[directory] = entry
+                    num_listed += listed
+                    next_level.extend('{}/{}'.format(directory, name) for name in entry[2])
+
+                level = next_level
+
+        num_removed = sum(1 for directory in self.dirs if directory not in found)
+        self.dirs = found
+
+        return num_listed + num_removed
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory != '':
+            os.makedirs(directory, exist_ok=True)
+
+        with open(self.path, 'w') as f:
+            json.dump({'root': self.root, 'dirs': self.dirs}, f)
+
+    def _scan(self, directories):
+        # returns (entry, whether it had to be listed) for every directory
+        return [self._scan_directory(directory) for directory in directories]
+
+    def _scan_directory(self, directory):
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+
+            cached = self.dirs.get(directory)
+            if cached is not None and cached[0] == mtime:
+                return cached, 0
+
+            files, subdirs = dict(), []
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False): # never walk into a symlink cycle
+                        subdirs.append(entry.name)
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        files[entry.name] = [stat.st_size, stat.st_mtime_ns]
+
+            return [mtime, files, sorted(subdirs)], 1
+        except FileNotFoundError:
+            return None, 0
+
+def dataset_name(master_dir):
+    """
+        Returns the name of the dataset in `master_dir` (its last path component, whether or
+        not `master_dir` ends in '/'), which names its verify text file and caches in data/.
+    """
+    return os.path.basename(os.path.normpath(master_dir))
+
+def dataset_manifest(master_dir):
+    """
+        Returns the up-to-date `DatasetManifest` of the dataset in `master_dir`, kept next to its verify text file.
+    """
+    manifest = DatasetManifest('data/{}.manifest.json'.format(dataset_name(master_dir)), master_dir)
+
+    if manifest.refresh() > 0:
+        manifest.save()
+
+    return manifest
@@ -0,0 +1,583 @@
+from math import fsum
+
+# Metrics derived from the overlap between an actual and a predicted `ClusterGraph`.
+#
+# Every vertex in actual cluster A and predicted cluster P scores
+#   precision = |A & P| / |P|,  recall = |A & P| / |A|,  fscore = 2|A & P| / (|A| + |P|)
+# so all of the vertices in one (A, P) cell of the overlap table share a score,
+# and the per-vertex averages only need the cell counts and the cluster sizes.
+
+def cluster_labels(graph):
+    """
+        Returns a tuple of (labels, sizes), where `labels` maps each vertex name in `graph`
+        to the index of its cluster and `sizes[i]` is the number of vertices in cluster i.
+    """
+    if hasattr(graph, 'get_labels'): # an `ArrayCG` already has them, numbered like `get_clusters`
+        name = graph.table.name
+        labels = {name(id): label for id, label in enumerate(graph.get_labels()) if label >= 0}
+        sizes = graph.cluster_sizes()
+        return labels, sizes
+
+    labels = dict()
+    sizes = []
+
+    for label, cluster in enumerate(graph.get_clusters()):
+        for vertex in cluster:
+            labels[vertex.name] = label
+        sizes.append(len(cluster))
+
+    return labels, sizes
+
+def shares_table(actual, predicted):
+    """
+        Returns True if both graphs number their vertices with the same `NameTable`,
+        so their label arrays line up by vertex id without comparing any names.
+    """
+    table = getattr(actual, 'table', None)
+    return table is not None and table is getattr(predicted, 'table', None)
+
+def table_labels(actual, predicted):
+    """
+        Returns (ids, actual labels, predicted labels) as aligned int32 arrays over every
+        id that is a vertex of either graph, with -1 where a graph lacks the vertex.
+        Both graphs must share a `NameTable`.
+    """
+    import numpy as np
+
+    size = len(actual.table)
+    act = np.full(size, -1, dtype=np.int32)
+    pred = np.full(size, -1, dtype=np.int32)
+
+    labels = actual.get_labels()
+    act[:len(labels)] = labels
+    labels = predicted.get_labels()
+    pred[:len(labels)] = labels
+
+    ids = np.flatnonzero((act >= 0) | (pred >= 0))
+
+    return ids, act[ids], pred[ids]
+
+def predicted_label_lookup(actual, predicted):
+    """
+        Returns (label_of, sizes), where `label_of(vertex)` is the index of the `predicted`
+        cluster holding a vertex of `actual`, and `sizes[i]` is the number of vertices in
+        predicted cluster i.
+
+        Like the name lookup, `label_of` raises a KeyError for a vertex `predicted` does not hold.
+    """
+    if shares_table(actual, predicted):
+        labels = predicted.get_labels().tolist()
+
+        def label_of(vertex):
+            label = labels[vertex.id] if vertex.id < len(labels) else -1
+            if label < 0:
+                raise KeyError(actual.table.name(vertex.id))
+            return label
+
+        return label_of, predicted.cluster_sizes()
+
+    labels, sizes = cluster_labels(predicted)
+    return lambda vertex: labels[vertex.name], sizes
+
+def overlap_table(actual, predicted):
+    """
+        Builds the actual-cluster x predicted-cluster overlap table of two `ClusterGraph`s
+        in a single pass over the actual vertices.
+
+        Returns a tuple of (table, actual_sizes, predicted_sizes), where `table` maps
+        (actual label, predicted label) to the number of vertices in both clusters.
+    """
+    if shares_table(actual, predicted):
+        return _id_overlap_table(actual, predicted)
+
+    actual_labels, actual_sizes = cluster_labels(actual)
+    predicted_labels, predicted_sizes = cluster_labels(predicted)
+
+    table = dict()
+
+    for vertex in actual.vertices:
+        cell = (actual_labels[vertex.name], predicted_labels[vertex.name])
+        table[cell] = table.get(cell, 0) + 1
+
+    return table, actual_sizes, predicted_sizes
+
+def _id_overlap_table(actual, predicted):
+    # the same table, lining the two graphs up by vertex id
+    actual_labels, predicted_labels = actual.get_labels(), predicted.get_labels()
+    actual_sizes, predicted_sizes = actual.cluster_sizes(), predicted.cluster_sizes()
+
+    table = dict()
+
+    for id, a in enumerate(actual_labels):
+        if a < 0: continue
+
+        p = predicted_labels[id] if id < len(predicted_labels) else -1
+        if p < 0:
+            raise KeyError(actual.table.name(id))
+
+        cell = (a, p)
+        table[cell] = table.get(cell, 0) + 1
+
+    return table, actual_sizes, predicted_sizes
+
+def vertex_metrics(table, actual_sizes, predicted_sizes):
+    """
+        Returns the precision, recall, and fscore averaged over every vertex in `table`.
+    """
+    precision, recall, fscore = [], [], []
+
+    for (a, p), n in table.items():
+        # n vertices, each scoring n / |P|, n / |A| and 2n / (|A| + |P|)
+        precision.append(n * n / predicted_sizes[p])
+        recall.append(n * n / actual_sizes[a])
+        fscore.append(2 * n * n / (actual_sizes[a] + predicted_sizes[p]))
+
+    num_vertices = sum(table.values())
+
+    return fsum(precision) / num_vertices, fsum(recall) / num_vertices, fsum(fscore) / num_vertices
+
+class IncrementalMetrics:
+    """
+        The precision, recall, and fscore of `vertex_metrics` for a clustering that keeps
+        changing, against fixed predicted clusters of sizes `predicted_sizes`.
+
+        The clustering is made of groups (e.g. the components of a `ConstraintStore`), and
+        every group keeps how many of its vertices are in each predicted cluster along with
+        its share of the sums, so a change only rescores the groups it touches.
+    """
+
+    def __init__(self, predicted_sizes):
+        self.predicted_sizes = predicted_sizes
+
+        self.overlaps = dict() # group -> {predicted label: number of its vertices in that cluster}
+        self.sizes = dict() # group -> number of vertices
+        self.terms = dict() # group -> (precision, recall, fscore) summed over its vertices
+
+        self.totals = [0.0, 0.0, 0.0]
+        self.num_vertices = 0
+
+    def add(self, group, labels):
+        """
+            Adds vertices in the predicted clusters `labels` to `group`.
+        """
+        overlap = self.overlaps.setdefault(group, dict())
+        for label in labels:
+            overlap[label] = overlap.get(label, 0) + 1
+
+        self.sizes[group] = self.sizes.get(group, 0) + len(labels)
+        self.num_vertices += len(labels)
+
+        self._rescore(group)
+
+    def remove(self, group, label):
+        """
+            Removes a vertex in predicted cluster `label` from `group`.
+        """
+        overlap = self.overlaps[group]
+        overlap[label] -= 1
+        if overlap[label] == 0:
+            del overlap[label]
+
+        self.sizes[group] -= 1
+        self.num_vertices -= 1
+
+        self._rescore(group)
+
+    def merge(self, group, other):
+        """
+            Moves every vertex of group `other` into `group`.
+        """
+        overlap, other_overlap = self.overlaps[group], self.overlaps.pop(other)
+
+        # fold the smaller table into the larger one
+        if len(overlap) < len(other_overlap):
+            overlap, other_overlap = other_overlap, overlap
+            self.overlaps[group] = overlap
+
+        for label, count in other_overlap.items():
+            overlap[label] = overlap.get(label, 0) + count
+
+        self.sizes[group] += self.sizes.pop(other)
+
+        self._unscore(other)
+        self._rescore(group)
+
+    def regroup(self, group_of, groups=None):
+        """
+            Merges every group into group `group_of(group)`, e.g. the component root of a
+            cluster once many decisions were made at once. If only some `groups` can have
+            moved, only those are looked at.
+        """
+        overlaps, sizes = self.overlaps, self.sizes
+        targets = set()
+
+        for group in list(overlaps) if groups is None else [group for group in groups if group in overlaps]:
+            target = group_of(group)
+            if target == group: continue
+
+            overlap, target_overlap = overlaps.pop(group), overlaps.setdefault(target, dict())
+            for label, count in overlap.items():
+                target_overlap[label] = target_overlap.get(label, 0) + count
+
+            sizes[target] = sizes.get(target, 0) + sizes.pop(group)
+            self._unscore(group)
+            targets.add(target)
+
+        # a target is only rescored once, however many groups joined it
+        for target in targets:
+            self._rescore(target)
+
+    def scores(self):
+        """
+            Returns the precision, recall, and fscore averaged over every vertex.
+        """
+        if self.num_vertices == 0:
+            return 0.0, 0.0, 0.0
+
+        return tuple(total / self.num_vertices for total in self.totals)
+
+    def _unscore(self, group):
+        for i, term in enumerate(self.terms.pop(group, (0.0, 0.0, 0.0))):
+            self.totals[i] -= term
+
+    def _rescore(self, group):
+        self._unscore(group)
+
+        size = self.sizes[group]
+        if size == 0:
+            del self.overlaps[group], self.sizes[group]
+            return
+
+        predicted_sizes = self.predicted_sizes
+        precision, squares, fscore = 0.0, 0, 0.0
+
+        # n vertices, each scoring n / |P|, n / |A| and 2n / (|A| + |P|)
+        for label, n in self.overlaps[group].items():
+            precision += n * n / predicted_sizes[label]
+            squares += n * n
+            fscore += 2 * n * n / (size + predicted_sizes[label])
+
+        terms = self.terms[group] = (precision, squares / size, fscore)
+        for i, term in enumerate(terms):
+            self.totals[i] += term
+
+def label_arrays(actual, predicted):
+    """
+        Returns two aligned int32 arrays holding the actual and predicted cluster label of
+        every vertex, over a shared node ordering: every actual vertex in `actual.vertices`
+        order, followed by any vertex that only exists in `predicted` (with actual label -1).
+        Graphs sharing a `NameTable` are ordered by vertex id instead.
+    """
+    _, act, pred = labelled_vertices(actual, predicted)
+    return act, pred
+
+def labelled_vertices(actual, predicted):
+    """
+        Like `label_arrays`, but returns (name_of, actual labels, predicted labels), where
+        `name_of(i)` is the name of the vertex at index i of the arrays.
+    """
+    import numpy as np
+
+    if shares_table(actual, predicted):
+        ids, act, pred = table_labels(actual, predicted)
+        if np.any(pred < 0):
+            raise KeyError(actual.table.name(int(ids[np.argmax(pred < 0)])))
+        return lambda i: actual.table.name(int(ids[i])), act, pred
+
+    actual_labels, _ = cluster_labels(actual)
+    predicted_labels, _ = cluster_labels(predicted)
+
+    names = [vertex.name for vertex in actual.vertices]
+    names.extend(name for name in predicted_labels if name not in actual_labels)
+
+    act = np.fromiter((actual_labels.get(name, -1) for name in names), dtype=np.int32, count=len(names))
+    pred = np.fromiter((predicted_labels[name] for name in names), dtype=np.int32, count=len(names))
+
+    return names.__getitem__, act, pred
+
+def label_overlaps(actual_labels, predicted_labels):
+    """
+        The vectorized overlap table of two aligned label arrays.
+
+        Returns a tuple of (cell_actual, cell_predicted, counts, actual_sizes, predicted_sizes),
+        where the first three arrays list every non-empty (actual, predicted) cell.
+    """
+    import numpy as np
+
+    predicted_sizes = np.bincount(predicted_labels)
+
+    in_actual = actual_labels >= 0
+    actual_labels = actual_labels[in_actual]
+    actual_sizes = np.bincount(actual_labels)
+
+    num_predicted = max(len(predicted_sizes), 1)
+    pairs = actual_labels.astype(np.int64) * num_predicted + predicted_labels[in_actual]
+    cells, counts = np.unique(pairs, return_counts=True)
+
+    return cells // num_predicted, cells % num_predicted, counts, actual_sizes, predicted_sizes
+
+def label_metric_terms(cell_actual, cell_predicted, counts, actual_sizes, predicted_sizes):
+    """
+        Returns the per-cell precision, recall, and fscore sums as float64 arrays.
+
+        Each term is computed exactly as `vertex_metrics` computes it, so summing them
+        with `math.fsum` reproduces its results bit for bit.
+    """
+    import numpy as np
+
+    squares = counts.astype(np.float64) ** 2
+    cell_actual_sizes = actual_sizes[cell_actual].astype(np.float64)
+    cell_predicted_sizes = predicted_sizes[cell_predicted].astype(np.float64)
+
+    precision = squares / cell_predicted_sizes
+    recall = squares / cell_actual_sizes
+    fscore = 2 * squares / (cell_actual_sizes + cell_predicted_sizes)
+
+    return precision, recall, fscore
+
+def label_metrics(actual_labels, predicted_labels):
+    """
+        Returns the precision, recall, and fscore averaged over every vertex with an actual label.
+    """
+    overlaps = label_overlaps(actual_labels, predicted_labels)
+    precision, recall, fscore = label_metric_terms(*overlaps)
+
+    num_vertices = int(overlaps[2].sum())
+
+    return fsum(precision.tolist()) / num_vertices, fsum(recall.tolist()) / num_vertices, fsum(fscore.tolist()) / num_vertices
+
+def metrics_report(actual_labels, predicted_labels, top_k=10):
+    """
+        Computes every metric below from one overlap table of two aligned label arrays
+        and returns them as a dict:
+        - 'vertices', 'actual_clusters', 'predicted_clusters' : what was compared
+        - 'vertex' : the averaged per-vertex precision, recall, and fscore of `label_metrics`
+        - 'bcubed' : BCubed precision and recall (the same averages), with their harmonic mean as fscore
+        - 'pairwise' : precision, recall, and fscore over every pair of vertices put in one cluster
+        - 'ari' : the adjusted Rand index
+        - 'nmi' : the normalized mutual information (arithmetic mean normalization)
+        - 'purity' : the share of vertices in the majority actual cluster of their predicted cluster
+        - 'impure' : the `top_k` predicted clusters with the most vertices outside their majority
+          actual cluster, most first, as dicts of 'label', 'size', 'majority' (an actual
+          label), 'purity', 'misplaced' and 'example' (the index of one of its vertices)
+
+        Vertices without an actual label are left out, except from the predicted cluster
+        sizes behind 'vertex' and 'bcubed', which are counted as in `label_metrics`.
+    """
+    import numpy as np
+    from math import log
+
+    overlaps = label_overlaps(actual_labels, predicted_labels)
+    cell_actual, cell_predicted, counts, actual_sizes, _ = overlaps
+
+    num_vertices = int(counts.sum())
+    precision, recall, fscore = (fsum(terms.tolist()) / num_vertices for terms in label_metric_terms(*overlaps))
+
+    # the predicted sizes over the vertices with an actual label
+    predicted_sizes = np.bincount(cell_predicted, weights=counts).astype(np.int64)
+
+    # pair counts are exact integers
+    def pairs(sizes):
+        sizes = sizes.astype(np.int64)
+        return int((sizes * (sizes - 1) // 2).sum())
+
+    together = pairs(counts) # pairs in one actual and one predicted cluster
+    actual_pairs, predicted_pairs = pairs(actual_sizes), pairs(predicted_sizes)
+    all_pairs = num_vertices * (num_vertices - 1) // 2
+
+    pairwise_precision = together / predicted_pairs if predicted_pairs > 0 else 1.0
+    pairwise_recall = together / actual_pairs if actual_pairs > 0 else 1.0
+
+    expected = actual_pairs * predicted_pairs / all_pairs if all_pairs > 0 else 0.0
+    best = (actual_pairs + predicted_pairs) / 2
+    ari = (together - expected) / (best - expected) if best != expected else 1.0
+
+    # every non-empty cell adds (n/N) log(N n / (|A| |P|)) to the mutual information
+    cell_counts = counts.astype(np.float64)
+    information = cell_counts / num_vertices * (np.log(cell_counts) + log(num_vertices)
+        - np.log(actual_sizes[cell_actual].astype(np.float64)) - np.log(predicted_sizes[cell_predicted].astype(np.float64)))
+    mutual_information = fsum(information.tolist())
+
+    def entropy(sizes):
+        shares = sizes[sizes > 0].astype(np.float64) / num_vertices
+        return -fsum((shares * np.log(shares)).tolist())
+
+    entropies = entropy(actual_sizes) + entropy(predicted_sizes)
+    nmi = max(mutual_information, 0.0) / (entropies / 2) if entropies > 0 else 1.0
+
+    # the largest cell of every predicted cluster is its majority, as cells are sorted by count within each
+    order = np.lexsort((counts, cell_predicted))
+    last = np.flatnonzero(np.diff(cell_predicted[order], append=-1) != 0)
+    majority_labels = cell_predicted[order][last]
+    majority_actual = cell_actual[order][last]
+    majority_counts = counts[order][last]
+
+    misplaced = predicted_sizes[majority_labels] - majority_counts
+    worst = [i for i in np.argsort(-misplaced, kind='stable')[:top_k].tolist() if misplaced[i] > 0]
+
+    # one vertex of each of the worst clusters, to show them by
+    worst_labels = majority_labels[worst]
+    in_worst = np.flatnonzero(np.isin(predicted_labels, worst_labels) & (actual_labels >= 0))
+    worst_found, first = np.unique(predicted_labels[in_worst], return_index=True)
+    examples = dict(zip(worst_found.tolist(), in_worst[first].tolist()))
+
+    impure = []
+    for i in worst:
+        label = int(majority_labels[i])
+        impure.append({
+            'label': label,
+            'size': int(predicted_sizes[label]),
+            'majority': int(majority_actual[i]),
+            'purity': int(majority_counts[i]) / int(predicted_sizes[label]),
+            'misplaced': int(misplaced[i]),
+            'example': examples[label]
+        })
+
+    return {
+        'vertices': num_vertices,
+        'actual_clusters': int(np.count_nonzero(actual_sizes)),
+        'predicted_clusters': len(majority_labels),
+        'vertex': {'precision': precision, 'recall': recall, 'fscore': fscore},
+        'bcubed': {'precision': precision, 'recall': recall, 'fscore': _harmonic_mean(precision, recall)},
+        'pairwise': {'precision': pairwise_precision, 'recall': pairwise_recall, 'fscore': _harmonic_mean(pairwise_precision, pairwise_recall)},
+        'ari': ari,
+        'nmi': nmi,
+        'purity': int(majority_counts.sum()) / num_vertices,
+        'impure': impure
+    }
+
+def _harmonic_mean(precision, recall):
+    return 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+
+def format_report(report):
+    """
+        Returns a `metrics_report` as human-readable lines.
+    """
+    lines = ['{} vertices in {} actual and {} predicted clusters'.format(report['vertices'], report['actual_clusters'], report['predicted_clusters'])]
+
+    for name in ('vertex', 'bcubed', 'pairwise'):
+        scores = report[name]
+        lines.append('{:<9} precision {:.4f}  recall {:.4f}  fscore {:.4f}'.format(name, scores['precision'], scores['recall'], scores['fscore']))
+
+    lines.append('ARI {:.4f}  NMI {:.4f}  purity {:.4f}'.format(report['ari'], report['nmi'], report['purity']))
+
+    if len(report['impure']) > 0:
+        lines.append('Most impure predicted clusters:')
+        for cluster in report['impure']:
+            lines.append('  {} of {} misplaced (purity {:.2f}), e.g. {}'.format(cluster['misplaced'], cluster['size'], cluster['purity'], cluster['example']))
+
+    return '\n'.join(lines)
+
+def parallel_label_metrics(actual_labels, predicted_labels, workers=None):
+    """
+        `label_metrics` on a pool of `workers` processes (one per core by default).
+
+        The actual clusters are split into a shard per worker, of about equal numbers of
+        vertices. Every worker builds the overlap table of its shard from memory-mapped
+        copies of the label arrays, and returns the exact sums of their precision, recall, and
+        fscore terms, so the results match `label_metrics` bit for bit.
+    """
+    import os
+    import tempfile
+    import numpy as np
+    from concurrent.futures import ProcessPoolExecutor
+    from functools import partial
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    predicted_sizes = np.bincount(predicted_labels)
+    actual_sizes = np.bincount(actual_labels[actual_labels >= 0])
+
+    num_vertices = int(actual_sizes.sum())
+    if num_vertices == 0:
+        return label_metrics(actual_labels, predicted_labels)
+
+    bounds = _shard_bounds(actual_sizes, workers)
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for name, values in (('actual', actual_labels), ('predicted', predicted_labels), ('predicted_sizes', predicted_sizes)):
+            path = os.path.join(directory, '{}.npy'.format(name))
+            np.save(path, values)
+            paths.append(path)
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            shard_sums = list(executor.map(partial(_shard_metric_sums, *paths), bounds[:-1], bounds[1:]))
+
+    return tuple(_exact_float([part for sums in shard_sums for part in sums[i]]) / num_vertices for i in range(3))
+
+def _shard_bounds(actual_sizes, num_shards):
+    # label boundaries cutting the actual clusters into runs of about equal numbers of vertices
+    import numpy as np
+
+    cumulative = np.cumsum(actual_sizes)
+    targets = cumulative[-1] * np.arange(1, num_shards) / num_shards
+    bounds = np.searchsorted(cumulative, targets) + 1
+
+    return np.unique(np.concatenate(([0], bounds, [len(actual_sizes)]))).tolist()
+
+def _shard_metric_sums(actual_path, predicted_path, predicted_sizes_path, start, end):
+    # the exact precision, recall, and fscore sums of the actual clusters start..end-1
+    import numpy as np
+
+    actual_labels = np.load(actual_path, mmap_mode='r')
+    predicted_labels = np.load(predicted_path, mmap_mode='r')
+    predicted_sizes = np.load(predicted_sizes_path, mmap_mode='r')
+
+    in_shard = (actual_labels >= start) & (actual_labels < end)
+    shard_actual = actual_labels[in_shard] - start
+    shard_predicted = predicted_labels[in_shard]
+
+    actual_sizes = np.bincount(shard_actual, minlength=end - start)
+
+    num_predicted = max(len(predicted_sizes), 1)
+    pairs = shard_actual.astype(np.int64) * num_predicted + shard_predicted
+    cells, counts = np.unique(pairs, return_counts=True)
+
+    terms = label_metric_terms(cells // num_predicted, cells % num_predicted, counts, actual_sizes, predicted_sizes)
+
+    return [_exact_sum(values) for values in terms]
+
+def _exact_sum(values, chunk_size=1 << 26):
+    """
+        Returns the exact sum of an array of finite, non-negative floats, as a list of
+        (integer, exponent) parts adding up to the sum of integer * 2**exponent.
+
+        Every value is an integer mantissa of 53 bits times a power of two. Mantissas
+        are cut into halves of 26 and 27 bits and summed per exponent, which float64
+        does exactly as long as fewer than 2**26 values are summed at a time.
+    """
+    import numpy as np
+
+    parts = []
+
+    for start in range(0, len(values), chunk_size):
+        mantissas, exponents = np.frexp(values[start:start + chunk_size])
+        mantissas = (mantissas * 2.0**53).astype(np.int64)
+
+        lowest = int(exponents.min())
+        buckets = exponents - lowest
+
+        high = np.bincount(buckets, weights=(mantissas >> 26).astype(np.float64))
+        low = np.bincount(buckets, weights=(mantissas & ((1 << 26) - 1)).astype(np.float64))
+
+        total = 0
+        for shift, (h, l) in enumerate(zip(high.tolist(), low.tolist())):
+            total += ((int(h) << 26) + int(l)) << shift
+
+        parts.append((total, lowest - 53))
+
+    return parts
+
+def _exact_float(parts):
+    # the float closest to the sum of `_exact_sum` parts, rounded once like `math.fsum`
+    if len(parts) == 0:
+        return 0.0
+
+    exponent = min(exponent for _, exponent in parts)
+    total = sum(integer << (part_exponent - exponent) for integer, part_exponent in parts)
+
+    if exponent < 0:
+        return total / (1 << -exponent) # true division of ints rounds correctly
+    return float(total << exponent)
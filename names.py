@@ -0,0 +1,90 @@
+import sys
+from array import array
+
+_NO_KEY = object() # compares unequal to every directory key
+
+class NameTable:
+    """
+        Numbers node names, storing each one once.
+
+        Names are paths, so each is split at its last '/' into a directory,
+        stored once for all of its files, and a basename, which is interned so
+        e.g. '001.jpg' is one string however many directories hold one. Ids are
+        handed out densely from 0 in the order names are first seen.
+
+        A table can be shared by several graphs, so that the same name has the
+        same id in each of them.
+    """
+
+    def __init__(self):
+        self.prefixes = [] # prefix id -> everything before the basename, including the '/'
+        self.prefix_ids = dict() # directory (None for names without one) -> prefix id
+        self.basename_ids = [] # prefix id -> {basename: id}
+
+        self.name_prefixes = array('i') # id -> prefix id
+        self.basenames = [] # id -> basename
+
+    def __len__(self):
+        return len(self.basenames)
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def intern(self, name):
+        """
+            Returns the id of `name`, adding it to the table if it is new.
+        """
+        return self.intern_all([name])[0]
+
+    def intern_all(self, names):
+        """
+            Returns the ids of every name in `names`, adding the new ones to the table.
+        """
+        prefix_ids, basenames, name_prefixes = self.prefix_ids, self.basenames, self.name_prefixes
+
+        ids = []
+        last_key, prefix_id, basename_ids = _NO_KEY, None, None
+
+        for name in names:
+            # one rpartition is the cheapest split found; matching the last prefix with startswith costs more
+            directory, slash, basename = name.rpartition('/')
+            key = directory if slash else None
+
+            # names of one cluster tend to share a directory
+            if key != last_key:
+                prefix_id = prefix_ids.get(key)
+                if prefix_id is None:
+                    prefix_id = prefix_ids[key] = len(self.prefixes)
+                    self.prefixes.append(directory + slash)
+                    self.basename_ids.append(dict())
+
+                last_key, basename_ids = key, self.basename_ids[prefix_id]
+
+            id = basename_ids.get(basename)
+            if id is None:
+                basename = sys.intern(basename)
+                id = basename_ids[basename] = len(basenames)
+                basenames.append(basename)
+                name_prefixes.append(prefix_id)
+
+            ids.append(id)
+
+        return ids
+
+    def get(self, name):
+        """
+            Returns the id of `name`, or None if it is not in the table.
+        """
+        directory, slash, basename = name.rpartition('/')
+
+        prefix_id = self.prefix_ids.get(directory if slash else None)
+        if prefix_id is None:
+            return None
+
+        return self.basename_ids[prefix_id].get(basename)
+
+    def name(self, id):
+        """
+            Returns the name with id `id`.
+        """
+        return self.prefixes[self.name_prefixes[id]] + self.basenames[id]
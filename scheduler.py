@@ -0,0 +1,263 @@
+import os
+import random
+import threading
+
+# Pair schedulers decide which two clusters `ClusterWrapper.suggest_pairing` asks about next.
+
+def seed_schedulers(seed):
+    """
+        Seeds the generator every scheduler draws from (the global one of `random`), so sessions repeat.
+    """
+    random.seed(seed)
+
+class PairScheduler:
+    """
+        Picks the next pair of clusters to show to the annotator.
+    """
+
+    def suggest(self, cluster_wrapper):
+        """
+            Returns a tuple of two cluster ids from `cluster_wrapper` that could
+            still be the same cluster, or False if there are none left.
+        """
+        raise NotImplementedError
+
+    def start(self, cluster_wrapper):
+        """
+            Starts whatever preparation can happen before the first `suggest`, if any.
+        """
+        pass
+
+    def progress(self):
+        """
+            Returns a description of the preparation still under way, or None if there is none.
+        """
+        return None
+
+class RandomScheduler(PairScheduler):
+    """
+        Picks a uniformly random still-potent cluster, then a uniformly random cluster it could still be.
+    """
+
+    def suggest(self, cluster_wrapper):
+        constraints = cluster_wrapper.constraints
+
+        if len(constraints.potent) == 0: return False
+
+        id1 = constraints.potent.choice()
+        return id1, constraints.choose_can_be(id1)
+
+class SimilarityScheduler(PairScheduler):
+    """
+        Proposes the most visually similar cluster pairs first.
+
+        Every image gets a cheap feature vector (a downsampled grayscale image or
+        a colour histogram), taken from its grid thumbnail if a `ThumbnailStore`
+        has one. A cluster's feature is the normalised mean over up to
+        `images_per_cluster` of its images, spread evenly over them in name order,
+        so a cluster samples the same images in every session. The `k` nearest
+        clusters of every cluster (by cosine similarity) form a candidate list,
+        which is asked about from the most to the least similar pair, skipping
+        pairs that earlier decisions already settled. Clusters created by splits
+        during the session are not in the list; once it runs out, pairs are
+        picked at random.
+
+        Image features are kept in `cache_path` (an .npz file) between sessions,
+        along with the size and mtime of the file they were computed from. The
+        list can be ranked on a background thread (see `start`).
+    """
+
+    def __init__(self, k=10, feature='grayscale', images_per_cluster=10, features=None, thumbnails=None, cache_path=None):
+        self.k = k
+        self.feature = feature
+        self.images_per_cluster = images_per_cluster
+        self.thumbnails = thumbnails
+        self.cache_path = cache_path
+
+        self.features = dict() if features is None else features # image path -> feature vector
+        self.stamps = dict() # image path -> [size in bytes, mtime in ns] of the file its feature was computed from
+        self.candidates = None # (id1, id2) pairs, most similar last
+        self.fallback = RandomScheduler()
+
+        self.worker = None # the thread ranking the candidates, if `start` was called
+        self.num_ranked, self.num_to_rank = 0, 0 # clusters whose feature is done, out of all of them
+
+    def start(self, cluster_wrapper):
+        """
+            Ranks the candidates on a background thread, so the first `suggest` does not
+            wait for every cluster's images to be decoded. Until the ranking is done,
+            `suggest` picks pairs at random.
+        """
+        if self.candidates is not None or self.worker is not None: return
+
+        clusters = self._snapshot(cluster_wrapper)
+
+        self.worker = threading.Thread(target=self._rank_in_background, args=(clusters,), daemon=True)
+        self.worker.start()
+
+    def progress(self):
+        if self.worker is None or self.candidates is not None: return None
+        return 'ranking clusters by similarity: {}/{}'.format(self.num_ranked, self.num_to_rank)
+
+    def suggest(self, cluster_wrapper):
+        if self.candidates is None:
+            if self.worker is not None: # still ranking in the background
+                return self.fallback.suggest(cluster_wrapper)
+
+            self.candidates = self._rank_candidates(self._snapshot(cluster_wrapper))
+
+        constraints = cluster_wrapper.constraints
+
+        while len(self.candidates) > 0:
+            id1, id2 = self.candidates.pop()
+            if constraints.could_be(id1, id2):
+                return id1, id2
+
+        return self.fallback.suggest(cluster_wrapper)
+
+    def image_feature(self, image_path):
+        """
+            Returns the (cached) unit-length feature vector of one image.
+        """
+        stat = os.stat(image_path)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+
+        feature = self.features.get(image_path)
+        if feature is not None and self.stamps.get(image_path, stamp) == stamp:
+            return feature
+
+        import numpy as np
+        from PIL import Image
+
+        thumbnail = self.thumbnails.grid(image_path) if self.thumbnails is not None else None
+
+        with (Image.fromarray(thumbnail) if thumbnail is not None else Image.open(image_path)) as image:
+            if self.feature == 'histogram':
+                feature = np.asarray(image.convert('RGB').histogram(), dtype=np.float32)
+            else:
+                feature = np.asarray(image.convert('L').resize((16, 16)), dtype=np.float32).ravel()
+                feature -= feature.mean()
+
+        norm = np.linalg.norm(feature)
+        if norm > 0:
+            feature /= norm
+
+        self.features[image_path] = feature
+        self.stamps[image_path] = stamp
+        return feature
+
+    def cluster_feature(self, cluster):
+        """
+            Returns the unit-length mean feature of (a sample of) the images in `cluster`.
+        """
+        import numpy as np
+
+        names = sorted(vertex.name for vertex in cluster)
+        if len(names) > self.images_per_cluster:
+            names = [names[i * len(names) // self.images_per_cluster] for i in range(self.images_per_cluster)]
+
+        feature = np.mean([self.image_feature(name) for name in names], axis=0)
+
+        norm = np.linalg.norm(feature)
+        if norm > 0:
+            feature /= norm
+
+        return feature
+
+    def load_features(self, path):
+        """
+            Adds the image features saved to `path` by `save_features`, unless they are of another kind.
+        """
+        import numpy as np
+
+        with np.load(path) as saved:
+            if str(saved['feature']) != self.feature:
+                return
+
+            blob = saved['names'].tobytes()
+            offsets = saved['offsets'].tolist()
+            stamps = saved['stamps'].tolist()
+            features = saved['features'].astype(np.float32)
+
+        for i, (start, end) in enumerate(zip(offsets, offsets[1:])):
+            image_path = blob[start:end].decode('utf-8')
+            self.features.setdefault(image_path, features[i])
+            self.stamps.setdefault(image_path, stamps[i])
+
+    def save_features(self, path):
+        """
+            Saves the image features computed so far (as float16) to `path`.
+        """
+        import numpy as np
+
+        names = [name for name in self.features if name in self.stamps]
+
+        # the paths are one utf-8 blob, as in a .npz snapshot of the clusters
+        encoded = [name.encode('utf-8') for name in names]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(name) for name in encoded], out=offsets[1:])
+
+        directory = os.path.dirname(path)
+        if directory != '':
+            os.makedirs(directory, exist_ok=True)
+
+        with open(path, 'wb') as f:
+            np.savez(f,
+                feature=np.array(self.feature),
+                names=np.frombuffer(b''.join(encoded), dtype=np.uint8),
+                offsets=offsets,
+                stamps=np.array([self.stamps[name] for name in names], dtype=np.int64).reshape(-1, 2),
+                features=np.array([self.features[name] for name in names], dtype=np.float16)
+            )
+
+    def _snapshot(self, cluster_wrapper):
+        # (id, images) of every live cluster, copied so a background ranking never sees a decision half-applied
+        return [(id, cluster_wrapper.clusters[id].items[:]) for id in cluster_wrapper.constraints.live]
+
+    def _rank_in_background(self, clusters):
+        try:
+            self.candidates = self._rank_candidates(clusters)
+        finally:
+            if self.candidates is None: # the ranking failed; its error is printed by `threading`
+                self.candidates = []
+
+    def _rank_candidates(self, clusters, block_size=1024):
+        import numpy as np
+
+        ids = [id for id, _ in clusters]
+        if len(ids) < 2:
+            return []
+
+        self.num_ranked, self.num_to_rank = 0, len(clusters)
+
+        if self.cache_path is not None and os.path.exists(self.cache_path):
+            self.load_features(self.cache_path)
+
+        features = []
+        for _, cluster in clusters:
+            features.append(self.cluster_feature(cluster))
+            self.num_ranked += 1
+        features = np.stack(features)
+
+        if self.cache_path is not None:
+            self.save_features(self.cache_path)
+
+        k = min(self.k, len(ids) - 1)
+
+        pairs = dict() # (id1, id2) with id1 < id2 -> similarity
+
+        for start in range(0, len(ids), block_size):
+            similarity = features[start:start + block_size] @ features.T
+
+            rows = np.arange(similarity.shape[0])
+            similarity[rows, rows + start] = -np.inf # never pair a cluster with itself
+
+            nearest = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+
+            for row, columns in enumerate(nearest):
+                for column in columns:
+                    id1, id2 = ids[start + row], ids[column]
+                    pairs[min(id1, id2), max(id1, id2)] = float(similarity[row, column])
+
+        # most similar last, so `suggest` can pop from the end
+        return sorted(pairs, key=pairs.get)
@@ -0,0 +1,215 @@
+import json
+import time
+import random
+import argparse
+import instrument
+from supernodegraph import NodeCGMW, NodeCG, GRAPH_CLASSES
+from graph import ClusterWrapper
+from scheduler import RandomScheduler, SimilarityScheduler, seed_schedulers
+from metrics import label_metrics
+
+# Runs the meta-labelling loop of `MetaDisplay` without a GUI, answering every
+# question from a ground-truth clustering, to measure how fast a session goes
+# and how many questions it takes.
+#
+#   python simulate.py --truth data/meta.json --fragment 4
+#   python simulate.py --synthetic 100000 --distribution zipf --output simulation.json
+
+class Oracle:
+    """
+        Answers questions the way a flawless annotator would, from `truth`, a list of
+        lists of node names where each list is one true cluster.
+    """
+
+    def __init__(self, truth):
+        self.labels = dict() # node name -> index of its true cluster
+        for label, names in enumerate(truth):
+            for name in names:
+                self.labels[name] = label
+
+    def same(self, image1, image2):
+        return self.labels[image1] == self.labels[image2]
+
+def fragment(clusters, max_size, rng):
+    """
+        Splits every cluster of `clusters` into randomly sized pieces of at most `max_size`
+        names, which a session then has to join back together.
+    """
+    fragments = []
+
+    for names in clusters:
+        names = list(names)
+        rng.shuffle(names)
+
+        start = 0
+        while start < len(names):
+            end = start + rng.randint(1, max_size)
+            fragments.append(names[start:end])
+            start = end
+
+    rng.shuffle(fragments)
+    return fragments
+
+def simulate(cluster_wrapper, oracle, trust=100, max_decisions=None, sample_every=1000, seed=None):
+    """
+        Asks `cluster_wrapper` questions as `MetaDisplay` does and answers them with
+        `oracle`, until no pairings are left or `max_decisions` were made.
+
+        A question is a self-check (two images of one cluster) with the same chance as
+        in `MetaDisplay` for the given `trust`, and a pairing of two clusters otherwise.
+
+        Returns a dict with the number of questions of each kind and of each answer, the
+        number of seconds taken, whether the session ran to completion, and `potency`,
+        a list of [decisions, seconds, potency] taken every `sample_every` decisions.
+    """
+    rng = random.Random(seed)
+    cw = cluster_wrapper
+
+    counts = {'pairings': 0, 'self_checks': 0, 'good': 0, 'bad': 0, 'problems': 0}
+    potency = []
+    completed = False
+    decisions = 0
+
+    start = time.perf_counter()
+
+    while max_decisions is None or decisions < max_decisions:
+        if decisions % sample_every == 0:
+            cw.set_potency()
+            potency.append([decisions, time.perf_counter() - start, cw.potency])
+
+        check_self = rng.randint(0, 100) > trust
+
+        if check_self:
+            cluster, _ = cw.suggest_intra_pairing()
+            image1 = cw.get_node_name_from_cluster(cluster)
+            image2 = cw.get_node_name_from_cluster(cluster)
+
+            counts['self_checks'] += 1
+            if not oracle.same(image1, image2):
+                counts['problems'] += 1
+                cw.problem_with_cluster(cluster, image1, image2)
+        else:
+            pairing = cw.suggest_pairing()
+            if pairing is False:
+                completed = True
+                break
+
+            mc1, mc2 = pairing
+            image1 = cw.get_node_name_from_cluster(mc1)
+            image2 = cw.get_node_name_from_cluster(mc2)
+
+            counts['pairings'] += 1
+            if oracle.same(image1, image2):
+                counts['good'] += 1
+                cw.is_good_pairing(mc1, mc2)
+            else:
+                counts['bad'] += 1
+                cw.is_bad_pairing(mc1, mc2)
+
+        decisions += 1
+
+    seconds = time.perf_counter() - start
+
+    cw.set_potency()
+    potency.append([decisions, seconds, cw.potency])
+
+    return dict(counts, decisions=decisions, seconds=seconds, completed=completed, potency=potency)
+
+def session_scores(cluster_wrapper, oracle):
+    """
+        Returns the precision, recall, and fscore of the clusters `cluster_wrapper` has
+        joined so far against the truth of `oracle`.
+    """
+    import numpy as np
+
+    constraints = cluster_wrapper.constraints
+    truth, joined = [], []
+
+    for id in constraints.live:
+        root = constraints.find(id)
+        for vertex in cluster_wrapper.clusters[id]:
+            truth.append(oracle.labels[vertex.name])
+            joined.append(root)
+
+    _, joined = np.unique(np.array(joined, dtype=np.int64), return_inverse=True)
+
+    return label_metrics(np.array(truth, dtype=np.int32), joined.astype(np.int32))
+
+def load_clusters(path, graph_class=NodeCG):
+    """
+        Returns the actual clusters of a json file or .npz snapshot as lists of node names.
+    """
+    cg = NodeCGMW(graph_class=graph_class)
+    if path.endswith('.npz'):
+        cg.load_from_snapshot(path)
+    else:
+        cg.load_from_json_file(path)
+
+    return list(cg.actual.cluster_names())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Runs a meta-labelling session without the GUI, answering every question from a ground-truth clustering.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--truth', type=str, help='A json file or .npz snapshot whose actual clusters are the ground truth.')
+    source.add_argument('--synthetic', type=int, help='Use a synthetic ground truth of this many nodes instead (see bench.py).')
+    parser.add_argument('--distribution', type=str, choices=['uniform', 'zipf', 'singletons'], default='zipf', help='The cluster size distribution of a synthetic ground truth.')
+    parser.add_argument('--clusters', type=str, default=None, help='A json file or .npz snapshot whose actual clusters the session starts from. By default, every true cluster is cut into random fragments.')
+    parser.add_argument('--fragment', type=int, default=4, help='The largest fragment the true clusters are cut into.')
+    parser.add_argument('--trust', type=int, choices=range(0,101), default=100, help='As for main.py: a lower number means more self-checks on existing clusters.')
+    parser.add_argument('--scheduler', type=str, choices=['random', 'similarity'], default='random', help='How cluster pairings are chosen, as for main.py ("similarity" needs the images on disk).')
+    parser.add_argument('--graph', type=str, choices=sorted(GRAPH_CLASSES), default='node', help='How clusters are stored in memory, as for main.py.')
+    parser.add_argument('--max-decisions', type=int, default=None, help='Stop after this many decisions, even if pairings are left.')
+    parser.add_argument('--sample-every', type=int, default=1000, help='How many decisions apart potency is sampled.')
+    parser.add_argument('--seed', type=int, default=0, help='Seeds the fragments, the questions and the schedulers.')
+    parser.add_argument('--profile', action='store_true', help='Print the per-stage profile of the session (see main.py --profile).')
+    parser.add_argument('--output', type=str, default=None, help='Write the results, including potency over time, to this json file.')
+
+    args = parser.parse_args()
+
+    graph_class = GRAPH_CLASSES[args.graph]
+    rng = random.Random(args.seed)
+    seed_schedulers(args.seed)
+
+    if args.synthetic is not None:
+        from bench import synthetic_dataset
+        truth, _ = synthetic_dataset(args.synthetic, args.distribution, seed=args.seed)
+    else:
+        truth = load_clusters(args.truth, graph_class=graph_class)
+
+    clusters = load_clusters(args.clusters, graph_class=graph_class) if args.clusters is not None else fragment(truth, args.fragment, rng)
+
+    cg = NodeCGMW(graph_class=graph_class)
+    cg.actual.add_clusters(clusters)
+    cg.predicted.add_clusters(clusters)
+
+    scheduler = SimilarityScheduler() if args.scheduler == 'similarity' else RandomScheduler()
+    cw = ClusterWrapper(cg, scheduler=scheduler)
+    oracle = Oracle(truth)
+
+    print('Simulating {} clusters of {} true clusters...'.format(len(clusters), len(truth)))
+
+    if args.profile:
+        instrument.enable()
+
+    results = simulate(cw, oracle, trust=args.trust, max_decisions=args.max_decisions, sample_every=args.sample_every, seed=args.seed)
+
+    results['scores'] = session_scores(cw, oracle)
+    results['clusters'] = len(clusters)
+    results['true_clusters'] = len(truth)
+
+    print('{} decisions in {:.2f}s ({:.0f} decisions/s), {}'.format(
+        results['decisions'], results['seconds'], results['decisions'] / max(results['seconds'], 1e-9),
+        'ran to completion' if results['completed'] else 'stopped early'))
+    print('{} pairings ({} good, {} bad), {} self-checks ({} problems)'.format(
+        results['pairings'], results['good'], results['bad'], results['self_checks'], results['problems']))
+    print('Potency {} -> {}'.format(results['potency'][0][2], results['potency'][-1][2]))
+    print('Precision {:.4f}, recall {:.4f}, fscore {:.4f} against the truth'.format(*results['scores']))
+
+    profiler = instrument.disable()
+    if profiler is not None:
+        print(profiler.report())
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+        print('Wrote {}'.format(args.output))
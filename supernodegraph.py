@@ -1,19 +1,90 @@
 from graph import ClusterVertex, ClusterGraph, CGMetricsWrapper
+from array import array
+from itertools import groupby
+from operator import itemgetter
+from metrics import shares_table, table_labels, cluster_labels, overlap_table, vertex_metrics, label_arrays, labelled_vertices, label_metrics, parallel_label_metrics, metrics_report
 import os
-from os.path import isfile, join
+import sys
+from os.path import join
+from manifest import DatasetManifest
+from jsonstream import write_clusters, read_clusters
+from names import NameTable
+import instrument
+
+def _int_array(values):
+    # copies a NumPy array into an `array('i')`, whose items are C ints
+    import numpy as np
+
+    ints = array('i')
+    ints.frombytes(values.astype(np.intc).tobytes())
+    return ints
 
 # Implementations of the Abstract Classes in `graph.py`
 
 class SuperNodeCV():
     """
         A Supernode class that supports `NodeCV`
+
+        Supernodes form a disjoint-set forest. Merging two clusters points the
+        root of the smaller one at the root of the larger one (union by size)
+        and only defers moving its members, so a merge is O(1); the members are
+        folded into the root the next time its neighbors are asked for.
     """
 
     def __init__(self, neighbors=None):
         if neighbors is None:
-            self.neighbors = set()
+            self.members = set()
         else:
-            self.neighbors = neighbors
+            self.members = neighbors
+
+        self.parent = None
+        self.size = len(self.members)
+        self.absorbed = [] # roots merged into this one whose members have not been moved yet
+
+    def find(self):
+        """
+            Returns the root supernode of this supernode's cluster, compressing the path to it.
+        """
+        root = self
+        while root.parent is not None:
+            root = root.parent
+
+        node = self
+        while node.parent is not None and node.parent is not root:
+            node.parent, node = root, node.parent
+
+        return root
+
+    def union(self, other):
+        """
+            Merges the cluster rooted at `other` into the one rooted at this supernode
+            (or vice versa, whichever is smaller) and returns the new root.
+        """
+        if self is other:
+            return self
+
+        if self.size < other.size:
+            self, other = other, self
+
+        other.parent = self
+        self.size += other.size
+        self.absorbed.append(other)
+
+        return self
+
+    @property
+    def neighbors(self):
+        absorbed = self.absorbed
+        self.absorbed = []
+
+        while len(absorbed) > 0:
+            child = absorbed.pop()
+            self.members.update(child.members)
+            child.members = set()
+            absorbed.extend(child.absorbed)
+            child.absorbed = []
+
+        return self.members
 
 class NodeCV(ClusterVertex):
     """
@@ -24,28 +95,36 @@ class NodeCV(ClusterVertex):
         There must ALWAYS be a connected supernode.
     """
     def __init__(self, name, supernode=None):
-        super(NodeCV, self).__init__(name, set())
+        # the actual and predicted graphs hold a node of every name, which then share one string
+        super(NodeCV, self).__init__(sys.intern(name), set())
 
         if supernode is not None:
             self.supernode = supernode
         else:
             self.supernode = SuperNodeCV(neighbors=set([self]))
 
+    @property
+    def supernode(self):
+        self._supernode = self._supernode.find()
+        return self._supernode
+
+    @supernode.setter
+    def supernode(self, supernode):
+        self._supernode = supernode
 
     def connected_to(self, other_vertex):
         return other_vertex in self.supernode.neighbors
 
     def add_neighbor(self, other_vertex):
-        self.supernode.neighbors.update(other_vertex.supernode.neighbors)
-
-        for vertex in other_vertex.supernode.neighbors:
-            vertex.supernode = self.supernode
+        self.supernode.union(other_vertex.supernode)
 
     def get_neighbors(self):
         return self.supernode.neighbors
 
     def isolate(self):
-        self.supernode.neighbors.remove(self)
+        supernode = self.supernode
+        supernode.neighbors.remove(self)
+        supernode.size -= 1
         self.supernode = SuperNodeCV(neighbors=set([self]))
     
     def json(self):
@@ -58,9 +137,28 @@ class NodeCG(ClusterGraph):
     def __init__(self, vertices):
         self.vertices = vertices
 
+        # name -> vertex, kept in step with `self.vertices` so lookups are O(1)
+        self.name_index = {vertex.name: vertex for vertex in vertices}
+
     def add_vertex(self, vertex):
         self.vertices.add(vertex)
 
+        # a set keeps the first of two equal vertices, so the index does too
+        self.name_index.setdefault(vertex.name, vertex)
+
+    def add_cluster(self, vertex_names):
+        anchor_node = None
+
+        for vertex_name in vertex_names:
+            if vertex_name in self.name_index: continue
+
+            node = NodeCV(vertex_name)
+            if anchor_node is None:
+                anchor_node = node
+            else:
+                node.add_neighbor(anchor_node)
+            self.add_vertex(node)
+
     def get_clusters(self):
         clusters = []
 
@@ -74,99 +172,420 @@ class NodeCG(ClusterGraph):
 
         return clusters
 
-    def get_vertex(self, vertex_name):
+    def cluster_names(self):
+        roots = set()
+
         for vertex in self.vertices:
-            if vertex.name == vertex_name:
-                return vertex
-        return False
+            root = vertex.supernode
+            if root in roots: continue
 
-class NodeCGMW(CGMetricsWrapper):
-    def __init__(self, predicted=None, actual=None):
+            roots.add(root)
+            yield [member.name for member in root.neighbors]
 
-        if predicted is None:
-            predicted = NodeCG(set())
+    def get_vertex(self, vertex_name):
+        return self.name_index.get(vertex_name, False)
 
-        if actual is None:
-            actual = NodeCG(set())
+class ArrayCV(ClusterVertex):
+    """
+        A lightweight handle onto vertex `id` of an `ArrayCG`.
 
-        super(NodeCGMW, self).__init__(predicted=predicted, actual=actual)
+        Handles are created on demand and hold no cluster state of their own,
+        so two handles with the same name are interchangeable. Handles of graphs
+        sharing a `NameTable` compare and hash by id alone, so only handles of
+        one table should be mixed in a set.
+    """
+    __slots__ = ('graph', 'id')
 
-    def load_from_text_file(self, text_file_path):
-        with open(text_file_path, 'r') as f:
-            lines = f.read().split('\n')
-    
-        cur_dir = ''
-        incorrect_preds = []
+    def __init__(self, graph, id):
+        self.graph = graph
+        self.id = id
 
-        for line in lines:
-            if len(line) == 0: continue
+    @property
+    def name(self):
+        return self.graph.table.name(self.id)
 
-            if line[0] == '*': # this is a folder
-                # handle the previously
-                self._handle_incorrects(cur_dir, incorrect_preds)
+    def connected_to(self, other_vertex):
+        other_id = self.graph.vertex_id(other_vertex)
+        return other_id is not None and self.graph.find(self.id) == self.graph.find(other_id)
 
-                cur_dir = line[1:]
-                incorrect_preds = []
-            else: # this is an incorrect face
-                incorrect_preds.append(line)
+    def add_neighbor(self, other_vertex):
+        other_id = self.graph.vertex_id(other_vertex)
+        if other_id is None:
+            raise KeyError(other_vertex.name)
 
-        self._handle_incorrects(cur_dir, incorrect_preds)
+        self.graph.union(self.id, other_id)
 
-    def load_from_unorganized_folder(self, folder_path):
+    def get_neighbors(self):
+        return set(self.graph.cluster_vertices(self.graph.get_labels()[self.id]))
+
+    def isolate(self):
+        self.graph.isolate(self.id)
+
+    def json(self):
+        return {
+            'name': self.name,
+            'neighbors': [v.name for v in self.get_neighbors()]
+        }
+
+    def __eq__(self, other):
+        if isinstance(other, ArrayCV) and other.graph.table is self.graph.table:
+            return self.id == other.id
+        return isinstance(other, ClusterVertex) and self.name == other.name
+
+    def __hash__(self):
+        return hash(self.id)
+
+class ArrayVertices():
+    """
+        A read-only, set-like view of the vertices of an `ArrayCG`.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __len__(self):
+        return self.graph.num_vertices
+
+    def __iter__(self):
+        return (ArrayCV(self.graph, id) for id, element in enumerate(self.graph.elements) if element >= 0)
+
+    def __contains__(self, vertex):
+        return self.graph.vertex_id(vertex) is not None
+
+class ArrayCG(ClusterGraph):
+    """
+        A columnar implementation of ClusterGraph.
+
+        Every vertex name is interned once in a `NameTable` and vertices are
+        their ids in it; a table can be shared with other graphs, so some ids
+        may not be vertices of this one. Clusters live in a disjoint-set forest
+        stored in flat int32 arrays: `elements` maps each id to its forest
+        element (-1 if it is not a vertex), and `parent`/`size` hold the forest
+        itself. Isolating a vertex just gives it a fresh element, so the old one
+        can keep serving as an inner node.
+
+        The compact cluster view - `labels` (cluster id per vertex, -1 for ids
+        that are not vertices) and `offsets`/`members` (cluster i is
+        members[offsets[i]:offsets[i + 1]]) - is rebuilt from the forest on
+        demand after the clusters change.
+    """
+    def __init__(self, vertices=None, table=None):
+        self.table = NameTable() if table is None else table
+        self.num_vertices = 0
+
+        self.elements = array('i')
+        self.parent = array('i')
+        self.size = array('i')
+
+        self.labels = None
+        self.offsets = None
+        self.members = None
+
+        if vertices is not None:
+            # carry over the clusters of any existing vertices
+            vertices = set(vertices)
+            while len(vertices) > 0:
+                vertex = vertices.pop()
+                cluster = set([vertex]).union(vertex.get_neighbors())
+                vertices.difference_update(cluster)
+                self.add_cluster([c_vertex.name for c_vertex in cluster])
+
+    @property
+    def vertices(self):
+        return ArrayVertices(self)
+
+    def add_vertex(self, vertex):
+        """
+            Adds `vertex` to this graph as its own cluster, unless a vertex
+            with its name already exists.
+        """
+        self.add_cluster([vertex.name])
+
+    def add_cluster(self, vertex_names):
+        self.add_clusters([vertex_names])
+
+    def add_clusters(self, clusters):
+        # builds the new part of the forest in plain lists and appends it in one go
+        table, elements = self.table, self.elements
+        first = len(self.parent)
+        parent, size = [], []
+
+        for vertex_names in clusters:
+            ids = table.intern_all(vertex_names)
+
+            # grown geometrically, as the table may grow a few names at a time
+            if len(elements) < len(table):
+                elements.extend(array('i', [-1]) * max(len(table) - len(elements), len(elements)))
+
+            new_ids = [id for id in dict.fromkeys(ids) if elements[id] < 0]
+            if len(new_ids) == 0: continue
+
+            # the first new vertex is the root of the others
+            root = first + len(parent)
+            for element, id in enumerate(new_ids, root):
+                elements[id] = element
+
+            parent.extend([root] * len(new_ids))
+            size.append(len(new_ids))
+            size.extend([1] * (len(new_ids) - 1))
+
+        self.parent.extend(parent)
+        self.size.extend(size)
+        self.num_vertices += len(parent)
+
+        self.labels = None
+
+    def get_clusters(self):
+        self.get_labels()
+        return [set(self.cluster_vertices(label)) for label in range(len(self.offsets) - 1)]
+
+    def cluster_names(self):
+        self.get_labels()
+        name, offsets, members = self.table.name, self.offsets, self.members
+
+        for label in range(len(offsets) - 1):
+            yield [name(id) for id in members[offsets[label]:offsets[label + 1]]]
+
+    def get_vertex(self, vertex_name):
+        id = self.table.get(vertex_name)
+        if id is None or id >= len(self.elements) or self.elements[id] < 0:
+            return False
+        return ArrayCV(self, id)
+
+    def vertex_id(self, vertex):
+        """
+            Returns the id of the vertex of this graph with the name of `vertex`, or None if there is none.
+        """
+        if isinstance(vertex, ArrayCV) and vertex.graph.table is self.table:
+            id = vertex.id
+        else:
+            id = self.table.get(vertex.name)
+
+        if id is None or id >= len(self.elements) or self.elements[id] < 0:
+            return None
+        return id
+
+    def find(self, id):
+        """
+            Returns the root element of the cluster holding vertex `id`.
+        """
+        return self._find(self.elements[id])
+
+    def union(self, id1, id2):
+        """
+            Merges the clusters holding vertices `id1` and `id2`.
+        """
+        root1, root2 = self.find(id1), self.find(id2)
+        if root1 == root2: return
+
+        if self.size[root1] < self.size[root2]:
+            root1, root2 = root2, root1
+
+        self.parent[root2] = root1
+        self.size[root1] += self.size[root2]
+        self.labels = None
+
+    def isolate(self, id):
+        """
+            Moves vertex `id` into a cluster of its own.
+        """
+        root = self.find(id)
+        if self.size[root] == 1: return
+
+        self.size[root] -= 1
+        self.elements[id] = self._new_element()
+        self.labels = None
+
+    def get_labels(self):
+        """
+            Returns the cluster id of every id of the table (or -1 where it is not
+            a vertex), rebuilding the compact cluster view if needed.
+
+            Cluster ids are numbered in order of each cluster's first vertex.
+        """
+        if self.labels is not None and len(self.labels) == len(self.table):
+            return self.labels
+
+        import numpy as np
+
+        # find every root at once by pointer jumping, which also fully compresses the forest
+        roots = np.array(self.parent, dtype=np.intc)
+        while True:
+            jumped = roots[roots]
+            if np.array_equal(jumped, roots): break
+            roots = jumped
+        self.parent = _int_array(roots)
+
+        # `elements` may be shorter than the table, or padded past it
+        elements = np.full(len(self.table), -1, dtype=np.intc)
+        count = min(len(self.elements), len(self.table))
+        elements[:count] = self.elements[:count]
+        ids = np.flatnonzero(elements >= 0)
+
+        _, first, inverse = np.unique(roots[elements[ids]], return_index=True, return_inverse=True)
+
+        # number clusters in order of their first vertex
+        rank = np.empty(len(first), dtype=np.intc)
+        rank[np.argsort(first)] = np.arange(len(first), dtype=np.intc)
+        vertex_labels = rank[inverse.ravel()]
+
+        labels = np.full(len(self.table), -1, dtype=np.intc)
+        labels[ids] = vertex_labels
+
+        offsets = np.zeros(len(first) + 1, dtype=np.intc)
+        np.cumsum(np.bincount(vertex_labels, minlength=len(first)), out=offsets[1:])
+        members = ids[np.argsort(vertex_labels, kind='stable')]
+
+        self.labels, self.offsets, self.members = _int_array(labels), _int_array(offsets), _int_array(members)
+
+        return self.labels
+
+    def cluster_vertices(self, label):
+        """
+            Yields a vertex handle for every member of cluster `label` of the compact view.
+        """
+        for id in self.members[self.offsets[label]:self.offsets[label + 1]]:
+            yield ArrayCV(self, id)
+
+    def cluster_sizes(self):
+        """
+            Returns a list of the number of vertices in every cluster of the compact view, by cluster id.
+        """
+        self.get_labels()
+
+        offsets = self.offsets
+        return [end - start for start, end in zip(offsets, offsets[1:])]
+
+    def _new_element(self):
+        element = len(self.parent)
+        self.parent.append(element)
+        self.size.append(1)
+        return element
+
+    def _find(self, element):
+        parent = self.parent
+
+        root = element
+        while parent[root] != root:
+            root = parent[root]
+
+        while parent[element] != root:
+            parent[element], element = root, parent[element]
+
+        return root
+
+# the ClusterGraph implementations, by the names the scripts' --graph options use
+GRAPH_CLASSES = {'node': NodeCG, 'array': ArrayCG}
+
+class NodeCGMW(CGMetricsWrapper):
+    def __init__(self, predicted=None, actual=None, graph_class=NodeCG):
+        # the `ClusterGraph` implementation built by the loaders
+        self.graph_class = graph_class
+
+        # the names of both graphs, so an `ArrayCG` vertex has the same id in each
+        self.table = NameTable()
+
+        if predicted is None:
+            predicted = self._new_graph()
+
+        if actual is None:
+            actual = self._new_graph()
+
+        super(NodeCGMW, self).__init__(predicted=predicted, actual=actual)
+
+    def _new_graph(self):
+        if issubclass(self.graph_class, ArrayCG):
+            return self.graph_class(table=self.table)
+        return self.graph_class(set())
+
+    @instrument.timed('cgmw.load_text')
+    def load_from_text_file(self, text_file_path, manifest=None):
         '''
-            Get all images from this folder and set each as its own separate node.
+            Loads the output of the binary labeler tool.
 
-            TODO: sanitization of filepaths
+            A folder may be labelled more than once; only its last record counts.
+            Folders are listed from `manifest` (a `DatasetManifest` of the dataset
+            holding them), which is built for their common parent if not given.
+            Folders missing from it (e.g. deleted since) are skipped.
         '''
+        records = dict() # folder -> incorrect predictions of its last record
+        for cur_dir, incorrect_preds in self._read_text_records(text_file_path):
+            records[cur_dir] = incorrect_preds
 
-        f = []
-        for _, _, filenames in os.walk(folder_path):
-            f.extend(filenames)
+        if manifest is None and len(records) > 0:
+            manifest = DatasetManifest(None, os.path.commonpath(list(records)))
+            manifest.refresh()
 
-        for filename in f:
-            node_name = f'{folder_path}/{filename}'
-            node = NodeCV(node_name)
-            self.predicted.add_vertex(node)
-            self.actual.add_vertex(node)
+        actual_clusters, predicted_clusters = [], []
+        for folder, incorrect_preds in records.items():
+            all_files = [join(folder, filename) for filename in manifest.files(folder) or ()]
+            if len(all_files) == 0: continue
 
-    def _handle_incorrects(self, cur_dir, incorrect_preds):
-        if cur_dir == '': return
+            incorrect_preds = set(incorrect_preds)
+            corrects = [f for f in all_files if f not in incorrect_preds]
 
-        all_files = set([join(cur_dir,f) for f in os.listdir(cur_dir) if isfile(join(cur_dir, f))])
-        if len(all_files) == 0: return
+            # the corrects form one actual cluster, while the predicted cluster wrongly holds the incorrects too
+            actual_clusters.append(corrects)
+            predicted_clusters.append(corrects + list(incorrect_preds))
 
-        incorrect_preds = set(incorrect_preds)
+            # the incorrects are actually lone nodes
+            actual_clusters.extend([incorrect_name] for incorrect_name in incorrect_preds)
 
-        corrects = all_files.difference(incorrect_preds)
+        self.actual.add_clusters(actual_clusters)
+        self.predicted.add_clusters(predicted_clusters)
 
-        # add corrects and cluster them
-        anchor_node_pred = NodeCV(corrects.pop())
-        anchor_node_actu = NodeCV(anchor_node_pred.name)
-        self.actual.add_vertex(anchor_node_actu)
-        self.predicted.add_vertex(anchor_node_pred)
+    @instrument.timed('cgmw.load_folder')
+    def load_from_unorganized_folder(self, folder_path, manifest=None):
+        '''
+            Get all images from this folder and set each as its own separate node.
+
+            Files are taken from `manifest` (a `DatasetManifest` of `folder_path`) if given.
+
+            TODO: sanitization of filepaths
+        '''
+        if manifest is None:
+            manifest = DatasetManifest(None, folder_path)
+            manifest.refresh()
 
-        for correct_name in corrects:
-            # predicted node
-            node_pred = NodeCV(correct_name)
-            node_pred.add_neighbor(anchor_node_pred)
-            self.predicted.add_vertex(node_pred)
+        clusters = [[node_name] for node_name in manifest.all_files()]
 
-            # actual node
-            node_actu = NodeCV(correct_name)
-            node_actu.add_neighbor(anchor_node_actu)
-            self.actual.add_vertex(node_actu)
+        self.predicted.add_clusters(clusters)
+        self.actual.add_clusters(clusters)
 
-        for incorrect_name in incorrect_preds:
-            # add the actuals as being lone nodes
-            bad_node_actu = NodeCV(incorrect_name)
-            self.actual.add_vertex(bad_node_actu)
+    @staticmethod
+    def _read_text_records(text_file_path):
+        # yields (folder, incorrect predictions) for every record, reading one line at a time
+        cur_dir = ''
+        incorrect_preds = []
 
-            # add predicted with wrong connections
-            bad_node_pred = NodeCV(incorrect_name)
-            bad_node_pred.add_neighbor(anchor_node_pred)
-            self.predicted.add_vertex(bad_node_pred)
+        with open(text_file_path, 'r') as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if len(line) == 0: continue
+
+                if line[0] == '*': # this is a folder
+                    if cur_dir != '':
+                        yield cur_dir, incorrect_preds
+
+                    cur_dir = line[1:]
+                    incorrect_preds = []
+                else: # this is an incorrect face
+                    incorrect_preds.append(line)
+
+        if cur_dir != '':
+            yield cur_dir, incorrect_preds
+
+    @instrument.timed('cgmw.metrics')
+    def metrics(self, mode='vertex', workers=None):
+        if mode == 'contingency':
+            return vertex_metrics(*overlap_table(self.actual, self.predicted))
+        elif mode == 'numpy':
+            return label_metrics(*label_arrays(self.actual, self.predicted))
+        elif mode == 'parallel':
+            return parallel_label_metrics(*label_arrays(self.actual, self.predicted), workers=workers)
+        elif mode != 'vertex':
+            raise ValueError('Unknown metrics mode {}'.format(mode))
 
-    def metrics(self):
         p,r,f = 0.0,0.0,0.0
         for actual_vertex in self.actual.vertices:
             predicted_vertex = self.predicted.get_vertex(actual_vertex.name)
@@ -180,6 +599,16 @@ class NodeCGMW(CGMetricsWrapper):
 
         return p,r,f
 
+    @instrument.timed('cgmw.report')
+    def report(self, top_k=10):
+        name_of, act, pred = labelled_vertices(self.actual, self.predicted)
+
+        report = metrics_report(act, pred, top_k=top_k)
+        for cluster in report['impure']:
+            cluster['example'] = name_of(cluster['example'])
+
+        return report
+
     def _metrics_per_vertex(self, actual_vertex, predicted_vertex):
 
         tp = len(predicted_vertex.get_neighbors().intersection(actual_vertex.get_neighbors()))
@@ -195,64 +624,105 @@ class NodeCGMW(CGMetricsWrapper):
 
         return precision, recall, fscore
 
+    @instrument.timed('cgmw.save_json')
     def save_to_json_file(self, json_file_path):
-        import json
+        # written a cluster at a time, rather than building the whole document in memory first
+        with open(json_file_path, 'w') as f:
+            write_clusters(f, [
+                ('actual', self.actual.cluster_names()),
+                ('predicted', self.predicted.cluster_names())
+            ])
 
-        json_dict = {
-            'actual': self._graph_to_dict(self.actual),
-            'predicted': self._graph_to_dict(self.predicted)
+    @instrument.timed('cgmw.load_json')
+    def load_from_json_file(self, json_file_path):
+        self.table = NameTable()
+        graphs = {
+            'actual': self._new_graph(),
+            'predicted': self._new_graph()
         }
 
-        with open(json_file_path, 'w') as f:
-            f.write(json.dumps(json_dict, indent=4))
+        with open(json_file_path, 'r') as f:
+            for key, clusters in groupby(read_clusters(f), key=itemgetter(0)):
+                if key in graphs:
+                    graphs[key].add_clusters(names for _, names in clusters)
 
-    def _graph_to_dict(self, graph):
-        # actual
-        vertices = graph.vertices.copy()
+        self.actual = graphs['actual']
+        self.predicted = graphs['predicted']
 
-        cluster_dict = dict()
+    @instrument.timed('cgmw.save_snapshot')
+    def save_to_snapshot(self, snapshot_path):
+        import numpy as np
 
-        cluster_count = 0
+        # vertices missing from either graph get label -1 there
+        if shares_table(self.actual, self.predicted):
+            ids, actual, predicted = table_labels(self.actual, self.predicted)
+            names = [self.table.name(id) for id in ids.tolist()]
+        else:
+            actual_labels, _ = cluster_labels(self.actual)
+            predicted_labels, _ = cluster_labels(self.predicted)
 
-        while len(vertices) > 0:
-            vertex = vertices.pop()
-            cluster = set([vertex]).union(vertex.get_neighbors())
-            vertices.difference_update(cluster)
-            vertex_names = [c_vertex.name for c_vertex in cluster]
-            cluster_dict[cluster_count] = vertex_names
-            cluster_count += 1
-        
-        return cluster_dict
+            names = list(actual_labels)
+            names.extend(name for name in predicted_labels if name not in actual_labels)
 
-    def load_from_json_file(self, json_file_path):
-        import json
+            actual = np.fromiter((actual_labels.get(name, -1) for name in names), dtype=np.int32, count=len(names))
+            predicted = np.fromiter((predicted_labels.get(name, -1) for name in names), dtype=np.int32, count=len(names))
 
-        with open(json_file_path, 'r') as f:
-            json_dict = json.loads(f.read())
+        # the names are one utf-8 blob, with name i at blob[offsets[i]:offsets[i + 1]]
+        encoded = [name.encode('utf-8') for name in names]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(name) for name in encoded], out=offsets[1:])
 
-        self.actual = self._dict_to_graph(json_dict['actual'])
-        self.predicted = self._dict_to_graph(json_dict['predicted'])
+        with open(snapshot_path, 'wb') as f:
+            np.savez(f,
+                names=np.frombuffer(b''.join(encoded), dtype=np.uint8),
+                offsets=offsets,
+                actual=actual,
+                predicted=predicted
+            )
 
-    def _dict_to_graph(self, json_dict):
-        graph = NodeCG(set())
-        for cluster in json_dict:
-            node_names = json_dict[cluster]
+    @instrument.timed('cgmw.load_snapshot')
+    def load_from_snapshot(self, snapshot_path):
+        import numpy as np
 
-            anchor_name = node_names.pop(0)
-            anchor_node = NodeCV(anchor_name)
-            graph.add_vertex(anchor_node)
+        with np.load(snapshot_path) as snapshot:
+            blob = snapshot['names'].tobytes()
+            offsets = snapshot['offsets'].tolist()
+            names = [blob[start:end].decode('utf-8') for start, end in zip(offsets, offsets[1:])]
 
-            for node_name in node_names:
-                node = NodeCV(node_name)
-                node.add_neighbor(anchor_node)
-                graph.add_vertex(node)
-        
-        return graph
+            self.table = NameTable()
+            self.actual = self._labels_to_graph(names, snapshot['actual'])
+            self.predicted = self._labels_to_graph(names, snapshot['predicted'])
 
-            
+    def _labels_to_graph(self, names, labels):
+        import numpy as np
 
+        # group the names by label with one sort, rather than a list per label
+        order = np.argsort(labels, kind='stable')
+        sorted_labels = labels[order]
+        starts = np.flatnonzero(np.diff(sorted_labels, prepend=-2)).tolist()
+        ends = starts[1:] + [len(order)]
 
-        
+        order = order.tolist()
+        clusters = [[names[i] for i in order[start:end]] for start, end in zip(starts, ends) if sorted_labels[start] >= 0]
 
+        graph = self._new_graph()
+        graph.add_clusters(clusters)
 
+        return graph
 
+def convert_snapshot(source_path, target_path, graph_class=ArrayCG):
+    '''
+        Converts a saved `NodeCGMW` between the json and .npz snapshot formats,
+        picking each format from the file extension.
+    '''
+    cg = NodeCGMW(graph_class=graph_class)
+
+    if source_path.endswith('.npz'):
+        cg.load_from_snapshot(source_path)
+    else:
+        cg.load_from_json_file(source_path)
+
+    if target_path.endswith('.npz'):
+        cg.save_to_snapshot(target_path)
+    else:
+        cg.save_to_json_file(target_path)
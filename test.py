@@ -1,4 +1,20 @@
-from supernodegraph import NodeCV, NodeCG, NodeCGMW
+from supernodegraph import NodeCV, NodeCG, ArrayCG, NodeCGMW, convert_snapshot
+from graph import ConstraintStore, ClusterWrapper
+from metrics import metrics_report
+from jsonstream import write_clusters, read_clusters
+from journal import DecisionJournal
+from manifest import DatasetManifest
+from names import NameTable
+from scheduler import SimilarityScheduler
+from display import MetaDisplay
+from itertools import combinations
+from math import log
+import io
+import os
+import json
+import random
+import shutil
+import tempfile
 import time
 
 def scenario_one():
@@ -65,6 +81,8 @@ def scenario_one():
 
     print('Expected', '(0.625, 1.0, 0.75)')
     print('Got     ', cgmw.metrics())
+    print('Contingency', cgmw.metrics(mode='contingency'))
+    print('NumPy      ', cgmw.metrics(mode='numpy'))
 
 def scenario_two(per_cluster=50):
     print('***Scenario Two***')
@@ -169,6 +187,16 @@ def scenario_two(per_cluster=50):
     print('Expected', '<NA>')
     print('Got     ', metrics)
 
+    start = time.time()
+    metrics = cgmw.metrics(mode='contingency')
+    print('Got contingency metrics in {}s'.format(time.time() - start))
+    print('Got     ', metrics)
+
+    start = time.time()
+    metrics = cgmw.metrics(mode='numpy')
+    print('Got numpy metrics in {}s'.format(time.time() - start))
+    print('Got     ', metrics)
+
 
     # cgmw.save_to_json_file('testest.json')
 
@@ -178,6 +206,788 @@ def scenario_two(per_cluster=50):
 
     # print(g)
 
+def brute_can_be(live, must_links, cannot_links):
+    # {live id: ids it could still be}, worked out from every decision made so far
+    ids = set(live).union(*must_links, *cannot_links)
+    component = {id: frozenset([id]) for id in ids}
+    for id1, id2 in must_links:
+        merged = component[id1] | component[id2]
+        for member in merged:
+            component[member] = merged
+
+    # a must-link overrules a cannot-link between the same components
+    cant = set()
+    for id1, id2 in cannot_links:
+        cant.add((component[id1], component[id2]))
+        cant.add((component[id2], component[id1]))
+
+    return {id1: set(id2 for id2 in live if component[id1] != component[id2]
+        and (component[id1], component[id2]) not in cant) for id1 in live}
+
+def random_decisions(store, steps, must_links, cannot_links):
+    for _ in range(steps):
+        live = sorted(store.live)
+        r = random.random()
+
+        if r < 0.1:
+            store.add()
+        elif r < 0.2 and len(live) > 0:
+            store.discard(random.choice(live))
+        elif len(live) >= 2:
+            id1, id2 = random.sample(live, 2)
+            if r < 0.4:
+                store.must_link(id1, id2)
+                must_links.append((id1, id2))
+            else:
+                store.cannot_link(id1, id2)
+                cannot_links.append((id1, id2))
+
+def scenario_three(runs=200):
+    print('***Scenario Three***')
+    random.seed(3)
+
+    for _ in range(runs):
+        store = ConstraintStore(random.randint(0, 20))
+        must_links, cannot_links = [], []
+
+        for _ in range(30):
+            random_decisions(store, 1, must_links, cannot_links)
+            can_be = brute_can_be(store.live, must_links, cannot_links)
+
+            assert store.potency() == sum(len(others) for others in can_be.values())
+            assert set(store.potent) == set(id for id, others in can_be.items() if len(others) > 0)
+
+            # the candidate indexes are kept up to date by every decision
+            for root, candidates in store.candidates.items():
+                member = next(iter(store.members[root])) # the root itself may be discarded
+                assert candidates == set(store.find(other) for other in can_be[member])
+                assert all(root in store.indexed_by[other] for other in candidates)
+            assert sum(map(len, store.candidates.values())) == sum(map(len, store.indexed_by.values()))
+
+            for id, others in can_be.items():
+                assert store.can_be(id) == others and store.num_can_be(id) == len(others)
+                # without rejection sampling the candidates get indexed, and with it the index is dropped
+                for tries in random.choice([(32,), (0,), (32, 0), (0, 0)]):
+                    choice = store.choose_can_be(id, tries=tries)
+                    assert choice in others if len(others) > 0 else choice is None
+
+        # the same decisions made with the bookkeeping deferred end up in the same place
+        num_clusters, seed = random.randint(2, 20), random.random()
+
+        direct = ConstraintStore(num_clusters)
+        random.seed(seed)
+        random_decisions(direct, 40, [], [])
+
+        deferred = ConstraintStore(num_clusters)
+        deferred.defer_bookkeeping()
+        random.seed(seed)
+        must_links, cannot_links = [], []
+        random_decisions(deferred, 40, must_links, cannot_links)
+        deferred.resume_bookkeeping()
+
+        can_be = brute_can_be(deferred.live, must_links, cannot_links)
+        assert deferred.potency() == direct.potency() == sum(len(others) for others in can_be.values())
+        assert set(deferred.potent) == set(direct.potent)
+        assert deferred.deficit == direct.deficit and deferred.cant_size == direct.cant_size
+        assert all(deferred.can_be(id) == others for id, others in can_be.items())
+
+    print('Checked potency, the potent clusters, and choose_can_be of {} random stores against brute force'.format(runs))
+
+def brute_vertex_metrics(actual, predicted):
+    # the per-vertex precision, recall, and fscore of two {name: cluster} dicts, vertex by vertex
+    scores = [0.0, 0.0, 0.0]
+
+    for name in actual:
+        same_actual = set(other for other in actual if actual[other] == actual[name])
+        same_predicted = set(other for other in predicted if predicted[other] == predicted[name])
+        n = len(same_actual & same_predicted)
+
+        scores[0] += n / len(same_predicted)
+        scores[1] += n / len(same_actual)
+        scores[2] += 2 * n / (len(same_actual) + len(same_predicted))
+
+    return tuple(score / len(actual) for score in scores)
+
+def scenario_four(runs=20):
+    print('***Scenario Four***')
+    random.seed(4)
+
+    for run in range(runs):
+        names = ['v{}'.format(i) for i in range(random.randint(2, 40))]
+        cg = NodeCGMW(graph_class=NodeCG if run % 2 == 0 else ArrayCG)
+        for clustering in (cg.actual, cg.predicted):
+            labels = [random.randrange(8) for _ in names]
+            clustering.add_clusters([[name for name, label in zip(names, labels) if label == cluster] for cluster in set(labels)])
+
+        predicted = {vertex.name: label for label, cluster in enumerate(cg.predicted.get_clusters()) for vertex in cluster}
+
+        cw = ClusterWrapper(cg, live_metrics=True)
+        for _ in range(30):
+            pairing = cw.suggest_pairing()
+            if pairing is False: break
+
+            mc1, mc2 = pairing
+            r = random.random()
+            cluster = [vertex.name for vertex in cw.clusters[mc1.id]]
+
+            if r < 0.2 and len(cluster) >= 2:
+                cw.problem_with_cluster(mc1, *random.sample(cluster, 2))
+            elif r < 0.5:
+                cw.is_good_pairing(mc1, mc2)
+            else:
+                cw.is_bad_pairing(mc1, mc2)
+
+            joined = {vertex.name: cw.constraints.find(id) for id in cw.constraints.live for vertex in cw.clusters[id]}
+
+            expected = brute_vertex_metrics(joined, predicted)
+            assert all(abs(a - b) < 1e-9 for a, b in zip(cw.live_metrics.scores(), expected)), (cw.live_metrics.scores(), expected)
+
+    # as for `metrics()`, an actual vertex missing from the predicted clusters is an error
+    for graph_class in (NodeCG, ArrayCG):
+        cg = NodeCGMW(graph_class=graph_class)
+        cg.actual.add_clusters([['a/1', 'a/2'], ['b/1']])
+        cg.predicted.add_clusters([['a/1', 'a/2', 'x/9']])
+        try:
+            ClusterWrapper(cg, live_metrics=True)
+            assert False, 'b/1 is not a predicted vertex'
+        except KeyError as error:
+            assert error.args == ('b/1',)
+
+    print('Checked the live metrics of {} random sessions against brute force'.format(runs))
+
+def scenario_five():
+    print('***Scenario Five***')
+    random.seed(5)
+
+    alphabet = ['a', 'b', '\\', '"', '/', ' ', '\u00e9', '\u4e2d', '\n', '{', '}', ':', ',', '[', ']']
+    sections = []
+    for key in ('actual', 'predicted'):
+        clusters = [[''.join(random.choice(alphabet) for _ in range(random.randint(0, 12))) for _ in range(random.randint(1, 6))] for _ in range(30)]
+        sections.append((key, clusters))
+
+    written = io.StringIO()
+    write_clusters(written, sections)
+    dumped = io.StringIO(json.dumps({key: {str(i): names for i, names in enumerate(clusters)} for key, clusters in sections}))
+
+    expected = [(key, names) for key, clusters in sections for names in clusters]
+    for f in (written, dumped):
+        for chunk_size in (1, 2, 7, 1 << 20):
+            f.seek(0)
+            assert list(read_clusters(f, chunk_size=chunk_size)) == expected
+
+    print('Read {} clusters back at every chunk size'.format(len(expected)))
+
+def scenario_six(runs=50):
+    print('***Scenario Six***')
+    import numpy as np
+    random.seed(6)
+
+    for _ in range(runs):
+        n = random.randint(2, 60)
+        actual_labels = np.array([random.randrange(-1, 6) for _ in range(n)], dtype=np.int32)
+        predicted_labels = np.array([random.randrange(8) for _ in range(n)], dtype=np.int32)
+        if (actual_labels >= 0).sum() < 2: continue
+
+        report = metrics_report(actual_labels, predicted_labels)
+
+        # pair counting, over the vertices with an actual label
+        labelled = [(a, p) for a, p in zip(actual_labels.tolist(), predicted_labels.tolist()) if a >= 0]
+        pairs = list(combinations(labelled, 2))
+        same_actual = [a1 == a2 for (a1, _), (a2, _) in pairs]
+        same_predicted = [p1 == p2 for (_, p1), (_, p2) in pairs]
+        together = sum(a and p for a, p in zip(same_actual, same_predicted))
+
+        expected_together = sum(same_actual) * sum(same_predicted) / len(pairs)
+        best = (sum(same_actual) + sum(same_predicted)) / 2
+        ari = (together - expected_together) / (best - expected_together) if best != expected_together else 1.0
+
+        # mutual information and entropies, straight from the label counts
+        N = len(labelled)
+        count = lambda items: {item: sum(1 for other in items if other == item) for item in set(items)}
+        cells = count(labelled)
+        actual_sizes, predicted_sizes = count([a for a, _ in labelled]), count([p for _, p in labelled])
+        information = sum(c / N * log(N * c / (actual_sizes[a] * predicted_sizes[p])) for (a, p), c in cells.items())
+        entropy = lambda sizes: -sum(c / N * log(c / N) for c in sizes.values())
+        entropies = entropy(actual_sizes) + entropy(predicted_sizes)
+        nmi = max(information, 0.0) / (entropies / 2) if entropies > 0 else 1.0
+
+        purity = sum(max(c for (a, p), c in cells.items() if p == label) for label in predicted_sizes) / N
+
+        assert abs(report['ari'] - ari) < 1e-9, (report['ari'], ari)
+        assert abs(report['nmi'] - nmi) < 1e-9, (report['nmi'], nmi)
+        assert abs(report['purity'] - purity) < 1e-12
+        if sum(same_predicted) > 0:
+            assert abs(report['pairwise']['precision'] - together / sum(same_predicted)) < 1e-12
+
+    print('Checked ARI, NMI, pairwise precision and purity of {} random labellings against brute force'.format(runs))
+
+def scenario_seven():
+    print('***Scenario Seven***')
+    random.seed(7)
+
+    for graph_class in (NodeCG, ArrayCG):
+        names = ['v{}'.format(i) for i in range(5000)]
+        cg = NodeCGMW(graph_class=graph_class)
+        for clustering in (cg.actual, cg.predicted):
+            labels = [random.randrange(700) for _ in names]
+            clustering.add_clusters([[name for name, label in zip(names, labels) if label == cluster] for cluster in set(labels)])
+
+        numpy_metrics = cg.metrics(mode='numpy')
+        for workers in (1, 2, 3):
+            assert cg.metrics(mode='parallel', workers=workers) == numpy_metrics
+
+    print('Expected', numpy_metrics)
+    print('Got     ', cg.metrics(mode='parallel', workers=2))
+
+def journal_session(graph_class, live_metrics, seed):
+    # a wrapper over the same random clusters for every `seed`
+    rng = random.Random(seed)
+    cg = NodeCGMW(graph_class=graph_class)
+    for cluster in range(rng.randint(2, 40)):
+        names = ['c{}/{}'.format(cluster, i) for i in range(rng.randint(1, 5))]
+        cg.actual.add_cluster(names)
+        cg.predicted.add_cluster(names[:2])
+        if len(names) > 2:
+            cg.predicted.add_cluster(names[2:])
+
+    return ClusterWrapper(cg, live_metrics=live_metrics)
+
+def session_state(cw):
+    # the components and cannot-links by the names they hold, which do not depend on cluster ids
+    constraints = cw.constraints
+    names = {root: frozenset(vertex.name for id in members for vertex in cw.clusters[id]) for root, members in constraints.members.items()}
+    cant = set((names[root], frozenset(names[other] for other in others)) for root, others in constraints.cant.items())
+    potent = sorted(vertex.name for id in constraints.potent for vertex in cw.clusters[id])
+
+    return set(names.values()), cant, constraints.potency(), potent
+
+def scenario_eight(runs=150):
+    print('***Scenario Eight***')
+    random.seed(8)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'session.journal')
+
+        for run in range(runs):
+            graph_class, live_metrics = (NodeCG, ArrayCG)[run % 2], run % 3 == 0
+            if os.path.exists(path):
+                os.remove(path)
+
+            cw = journal_session(graph_class, live_metrics, run)
+            cw.journal = DecisionJournal(path)
+            assert cw.journal.replay(cw) == 0
+
+            for _ in range(random.randint(1, 200)):
+                pairing = cw.suggest_pairing()
+                if pairing is False: break
+
+                mc1, mc2 = pairing
+                r = random.random()
+
+                if r < 0.25:
+                    mc = random.choice(pairing)
+                    cluster = [vertex.name for vertex in cw.clusters[mc.id]]
+                    if len(cluster) >= 2:
+                        cw.problem_with_cluster(mc, *random.sample(cluster, 2))
+                        continue
+
+                if r < 0.5:
+                    cw.is_good_pairing(mc1, mc2)
+                else:
+                    cw.is_bad_pairing(mc1, mc2)
+            cw.journal.close()
+
+            restored = journal_session(graph_class, live_metrics, run)
+            DecisionJournal(path).replay(restored)
+            assert session_state(restored) == session_state(cw), run
+            if live_metrics:
+                assert all(abs(a - b) < 1e-9 for a, b in zip(restored.live_metrics.scores(), cw.live_metrics.scores()))
+
+        # a journal of other clusters is refused before anything is applied
+        other = journal_session(NodeCG, False, runs)
+        potency = other.constraints.potency()
+        try:
+            DecisionJournal(path).replay(other)
+            assert False, 'the journal belongs to other clusters'
+        except ValueError:
+            assert other.constraints.potency() == potency
+
+        # a last line cut short by a crash is skipped, and the next decision starts a new line
+        os.remove(path)
+        cw = journal_session(NodeCG, False, 1)
+        cw.journal = DecisionJournal(path)
+        cw.journal.replay(cw)
+        cw.is_bad_pairing(*cw.suggest_pairing())
+        cw.journal.close()
+        with open(path, 'a') as f:
+            f.write('G\t{}'.format(cw.clusters[0][0].name))
+
+        restored = journal_session(NodeCG, False, 1)
+        restored.journal = DecisionJournal(path)
+        assert restored.journal.replay(restored) == 1
+        restored.is_good_pairing(*restored.suggest_pairing())
+        restored.journal.close()
+
+        assert DecisionJournal(path).replay(journal_session(NodeCG, False, 1)) == 2
+
+    print('Replayed the journals of {} random sessions into the same state'.format(runs))
+
+def scenario_nine(runs=30):
+    print('***Scenario Nine***')
+    random.seed(9)
+
+    def check_index(graph, names):
+        # every name finds the vertex `vertices` holds, as a scan over them would
+        for name in names:
+            matches = [vertex for vertex in graph.vertices if vertex.name == name]
+            assert graph.get_vertex(name) is (matches[0] if len(matches) > 0 else False)
+
+    for _ in range(runs):
+        graph = NodeCG(set())
+        names = ['d{}/{}.jpg'.format(random.randrange(4), i) for i in range(random.randint(2, 40))]
+
+        for _ in range(40):
+            r = random.random()
+            vertices = sorted(graph.vertices, key=lambda vertex: vertex.name)
+
+            if r < 0.3:
+                graph.add_vertex(NodeCV(random.choice(names)))
+            elif r < 0.6:
+                graph.add_cluster(random.sample(names, random.randint(1, min(5, len(names)))))
+            elif len(vertices) >= 2 and r < 0.8:
+                vertex1, vertex2 = random.sample(vertices, 2)
+                vertex1.add_neighbor(vertex2)
+            elif len(vertices) >= 1:
+                random.choice(vertices).isolate()
+
+            check_index(graph, names)
+
+    # and through the folder loader
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(20):
+            os.makedirs(os.path.join(directory, str(i % 3)), exist_ok=True)
+            open(os.path.join(directory, str(i % 3), '{}.jpg'.format(i)), 'w').close()
+
+        cg = NodeCGMW()
+        cg.load_from_unorganized_folder(directory)
+        names = ['{}/{}/{}.jpg'.format(os.path.normpath(directory), i % 3, i) for i in range(20)]
+        assert len(cg.actual.vertices) == len(cg.predicted.vertices) == 20
+        check_index(cg.actual, names + ['missing.jpg'])
+        check_index(cg.predicted, names)
+
+    print('Checked the name index of {} random graphs against a scan'.format(runs))
+
+def scenario_ten(runs=30):
+    print('***Scenario Ten***')
+    random.seed(10)
+
+    for _ in range(runs):
+        vertices = [NodeCV('v{}'.format(i)) for i in range(random.randint(1, 50))]
+        cluster_of = {vertex: set([vertex]) for vertex in vertices} # shared by the vertices of a cluster
+
+        for _ in range(100):
+            vertex1, vertex2 = random.choice(vertices), random.choice(vertices)
+
+            if random.random() < 0.7:
+                vertex1.add_neighbor(vertex2)
+                merged = cluster_of[vertex1] | cluster_of[vertex2]
+                for vertex in merged:
+                    cluster_of[vertex] = merged
+            else:
+                vertex1.isolate()
+                rest = cluster_of[vertex1] - set([vertex1])
+                for vertex in rest:
+                    cluster_of[vertex] = rest
+                cluster_of[vertex1] = set([vertex1])
+
+            # only some clusters are looked at, so others keep members that are not folded in yet
+            for vertex in random.sample(vertices, min(5, len(vertices))):
+                assert vertex.get_neighbors() == cluster_of[vertex]
+                assert vertex.supernode.size == len(cluster_of[vertex])
+                assert all(vertex.connected_to(other) == (other in cluster_of[vertex]) for other in vertices)
+
+    # a long chain of merges stays cheap, however it is built
+    chain = [NodeCV('c{}'.format(i)) for i in range(100000)]
+    start = time.time()
+    for vertex, previous in zip(chain[1:], chain):
+        vertex.add_neighbor(previous)
+    assert len(chain[0].get_neighbors()) == len(chain) and chain[-1].connected_to(chain[0])
+    print('Chained {} merges in {}s'.format(len(chain) - 1, time.time() - start))
+
+    print('Checked merging and isolating in {} random clusterings against plain sets'.format(runs))
+
+def scenario_eleven(runs=30):
+    print('***Scenario Eleven***')
+    random.seed(11)
+
+    for _ in range(runs):
+        graphs = [NodeCG(set()), ArrayCG()]
+        names = ['d{}/{}.jpg'.format(random.randrange(4), i) for i in range(random.randint(2, 40))]
+
+        for _ in range(40):
+            r = random.random()
+            name1, name2 = random.choice(names), random.choice(names)
+            cluster = random.sample(names, random.randint(1, min(5, len(names))))
+
+            for graph in graphs:
+                vertex1, vertex2 = graph.get_vertex(name1), graph.get_vertex(name2)
+
+                if r < 0.4:
+                    graph.add_cluster(cluster)
+                elif r < 0.5:
+                    graph.add_vertex(NodeCV(name1))
+                elif vertex1 is not False and vertex2 is not False and r < 0.8:
+                    vertex1.add_neighbor(vertex2)
+                elif vertex1 is not False:
+                    vertex1.isolate()
+
+            # the same operations leave both implementations with the same clusters
+            node, array = [set(frozenset(vertex.name for vertex in cluster) for cluster in graph.get_clusters()) for graph in graphs]
+            assert node == array
+            assert sorted(map(sorted, graphs[0].cluster_names())) == sorted(map(sorted, graphs[1].cluster_names()))
+            assert len(graphs[0].vertices) == len(graphs[1].vertices)
+
+            for name in names:
+                vertices = [graph.get_vertex(name) for graph in graphs]
+                assert (vertices[0] is False) == (vertices[1] is False)
+                if vertices[0] is not False:
+                    assert set(vertex.name for vertex in vertices[0].get_neighbors()) == set(vertex.name for vertex in vertices[1].get_neighbors())
+
+    print('Checked ArrayCG against NodeCG on {} random sequences of operations'.format(runs))
+
+def scenario_twelve(runs=10):
+    print('***Scenario Twelve***')
+    random.seed(12)
+
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as directory:
+            root = os.path.join(directory, 'ds')
+            files = dict() # folder -> its file paths
+            for i in range(random.randint(1, 8)):
+                folder = '{}/{}'.format(root, i)
+                os.makedirs(folder)
+                files[folder] = ['{}/{}.jpg'.format(folder, j) for j in range(random.randint(1, 6))]
+                for path in files[folder]:
+                    open(path, 'w').close()
+
+            # folders labelled several times over, and one that is gone
+            records = []
+            for _ in range(random.randint(1, 20)):
+                folder = random.choice(list(files) + ['{}/gone'.format(root)])
+                incorrect = random.sample(files.get(folder, []), random.randint(0, len(files.get(folder, []))))
+                records.append((folder, incorrect))
+
+            text_path = os.path.join(directory, 'ds.txt')
+            with open(text_path, 'w') as f:
+                for folder, incorrect in records:
+                    f.write('*{}\n'.format(folder))
+                    f.writelines('{}\n'.format(path) for path in incorrect)
+
+            # only the last record of a folder counts
+            actual, predicted = set(), set()
+            for folder, incorrect in dict(records).items():
+                if folder not in files: continue
+
+                corrects = frozenset(files[folder]) - frozenset(incorrect)
+                if len(corrects) > 0:
+                    actual.add(corrects)
+                actual.update(frozenset([path]) for path in incorrect)
+                predicted.add(frozenset(files[folder]))
+
+            for graph_class in (NodeCG, ArrayCG):
+                cg = NodeCGMW(graph_class=graph_class)
+                cg.load_from_text_file(text_path)
+
+                assert set(frozenset(vertex.name for vertex in cluster) for cluster in cg.actual.get_clusters()) == actual
+                assert set(frozenset(vertex.name for vertex in cluster) for cluster in cg.predicted.get_clusters()) == predicted
+                assert len(cg.actual.vertices) == sum(map(len, actual)) # no vertex was added twice
+
+    print('Checked the last-record-wins clusters of {} random verify files'.format(runs))
+
+def scenario_thirteen():
+    print('***Scenario Thirteen***')
+
+    def walked(root):
+        # {directory: sorted files} of a plain walk, for comparison
+        return {directory: sorted(filenames) for directory, _, filenames in os.walk(root)}
+
+    def listed(manifest):
+        return {directory: sorted(manifest.files(directory)) for directory in manifest.dirs}
+
+    def touch(directory):
+        # moves the mtime on by a second, as filesystems with a coarse clock may not have yet
+        mtime = os.stat(directory).st_mtime_ns + 10 ** 9
+        os.utime(directory, ns=(mtime, mtime))
+
+    with tempfile.TemporaryDirectory() as directory:
+        root = os.path.join(directory, 'ds')
+        for path in ('a/1.jpg', 'a/2.jpg', 'b/3.jpg', 'b/c/4.jpg'):
+            os.makedirs(os.path.dirname(os.path.join(root, path)), exist_ok=True)
+            open(os.path.join(root, path), 'w').close()
+
+        manifest_path = os.path.join(directory, 'ds.manifest.json')
+        manifest = DatasetManifest(manifest_path, root + '/')
+        assert manifest.refresh() == 4 and listed(manifest) == walked(root)
+        manifest.save()
+
+        # a saved manifest is not listed again while nothing changed
+        manifest = DatasetManifest(manifest_path, root)
+        assert manifest.refresh() == 0 and listed(manifest) == walked(root)
+
+        # a new file changes the mtime of its directory, which alone is listed again
+        open(os.path.join(root, 'a', '5.jpg'), 'w').close()
+        touch(os.path.join(root, 'a'))
+        assert manifest.refresh() == 1 and listed(manifest) == walked(root)
+
+        # a removed directory drops out, along with everything under it
+        shutil.rmtree(os.path.join(root, 'b', 'c'))
+        touch(os.path.join(root, 'b'))
+        assert manifest.refresh() == 2 and listed(manifest) == walked(root)
+        assert manifest.subdirs(os.path.join(root, 'b')) == []
+
+    print('Checked that a manifest only lists the directories whose mtime changed')
+
+def scenario_fourteen():
+    print('***Scenario Fourteen***')
+    random.seed(14)
+
+    def clusters_of(cg):
+        return [set(frozenset(vertex.name for vertex in cluster) for cluster in graph.get_clusters()) for graph in (cg.actual, cg.predicted)]
+
+    def random_clusters(names, num_labels):
+        labels = [random.randrange(num_labels) for _ in names]
+        return [[name for name, label in zip(names, labels) if label == cluster] for cluster in set(labels)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot_path = os.path.join(directory, 'cg.npz')
+        json_path = os.path.join(directory, 'cg.json')
+
+        for graph_class in (NodeCG, ArrayCG):
+            names = ['d{}/{}{}.jpg'.format(random.randrange(5), random.choice(['', 'é', '中 ']), i) for i in range(300)]
+
+            # some vertices are only in one of the graphs
+            cg = NodeCGMW(graph_class=graph_class)
+            cg.actual.add_clusters(random_clusters(names[:280], 40))
+            cg.predicted.add_clusters(random_clusters(names[20:], 60))
+            expected = clusters_of(cg)
+
+            cg.save_to_snapshot(snapshot_path)
+            for load_class in (NodeCG, ArrayCG):
+                loaded = NodeCGMW(graph_class=load_class)
+                loaded.load_from_snapshot(snapshot_path)
+                assert clusters_of(loaded) == expected
+
+            # json -> npz -> json keeps the clusters too
+            cg.save_to_json_file(json_path)
+            convert_snapshot(json_path, os.path.join(directory, 'converted.npz'), graph_class=graph_class)
+            convert_snapshot(os.path.join(directory, 'converted.npz'), os.path.join(directory, 'converted.json'))
+
+            loaded = NodeCGMW()
+            loaded.load_from_json_file(os.path.join(directory, 'converted.json'))
+            assert clusters_of(loaded) == expected
+
+    print('Round-tripped both graph classes through .npz snapshots and convert_snapshot')
+
+def scenario_fifteen(runs=200):
+    print('***Scenario Fifteen***')
+    random.seed(15)
+
+    # joined with '/', which gives names with empty, leading, trailing and doubled directories
+    parts = ['', 'a', 'b', 'é', 'data/x', '1.jpg']
+
+    for _ in range(runs):
+        table, ids = NameTable(), dict()
+
+        for _ in range(random.randint(1, 10)):
+            names = ['/'.join(random.choice(parts) for _ in range(random.randint(1, 4))) for _ in range(random.randint(0, 20))]
+
+            # ids are handed out densely, in the order names are first seen
+            expected = [ids.setdefault(name, len(ids)) for name in names]
+            if random.random() < 0.8:
+                assert table.intern_all(names) == expected
+            else:
+                assert [table.intern(name) for name in names] == expected
+            assert len(table) == len(ids)
+
+        for name, id in ids.items():
+            assert table.get(name) == id and table.name(id) == name and name in table
+
+        unseen = 'unseen/' + random.choice(parts)
+        assert table.get(unseen) is None and unseen not in table
+
+    print('Checked {} random name tables against a dict'.format(runs))
+
+def scenario_sixteen():
+    print('***Scenario Sixteen***')
+    random.seed(16)
+
+    import numpy as np
+    from PIL import Image
+
+    def write_image(path, pattern):
+        # a noisy copy of one of a few patterns, so clusters of the same pattern look alike
+        pixels = [min(255, max(0, value + random.randint(-40, 40))) for value in pattern]
+        Image.frombytes('L', (8, 8), bytes(pixels)).resize((32, 32)).save(path)
+
+    class FlatStore:
+        # a thumbnail store holding the same horizontal gradient for every image
+        def grid(self, path):
+            return np.repeat(np.repeat(np.arange(0, 240, 2, dtype=np.uint8)[None, :, None], 120, axis=0), 3, axis=2)
+
+    with tempfile.TemporaryDirectory() as directory:
+        patterns = [[random.randrange(256) for _ in range(64)] for _ in range(4)]
+
+        cg = NodeCGMW()
+        for cluster in range(24):
+            os.makedirs(os.path.join(directory, str(cluster)))
+            names = [os.path.join(directory, str(cluster), '{}.png'.format(i)) for i in range(random.randint(1, 12))]
+            for name in names:
+                write_image(name, patterns[cluster % 4])
+            cg.actual.add_cluster(names)
+            cg.predicted.add_cluster(names)
+        cw = ClusterWrapper(cg)
+
+        reference = SimilarityScheduler(k=3, images_per_cluster=4)
+        expected = reference._rank_candidates(reference._snapshot(cw))
+        assert len(expected) > 0
+
+        # a background ranking gives the same list, and saves the features it computed
+        cache_path = os.path.join(directory, 'features.npz')
+        scheduler = SimilarityScheduler(k=3, images_per_cluster=4, cache_path=cache_path)
+        scheduler.start(cw)
+        pairing = scheduler.suggest(cw)
+        assert cw.constraints.could_be(*pairing)
+        scheduler.worker.join()
+        assert scheduler.progress() is None and scheduler.candidates in (expected, expected[:-1]) # the first pair is popped if it was ready
+
+        # a later session reuses the saved features, except for an image rewritten since
+        changed = sorted(scheduler.features)[0]
+        write_image(changed, patterns[0])
+        mtime = os.stat(changed).st_mtime_ns + 10 ** 9
+        os.utime(changed, ns=(mtime, mtime))
+
+        later = SimilarityScheduler(k=3, images_per_cluster=4, cache_path=cache_path)
+        later._rank_candidates(later._snapshot(cw))
+        assert set(later.features) == set(scheduler.features)
+        for path, feature in later.features.items():
+            if path == changed:
+                assert later.stamps[path][1] == mtime and np.allclose(feature, SimilarityScheduler().image_feature(path))
+            else:
+                assert np.array_equal(feature, scheduler.features[path].astype(np.float16).astype(np.float32))
+
+        # features of another kind are not loaded
+        histogram = SimilarityScheduler(feature='histogram')
+        histogram.load_features(cache_path)
+        assert len(histogram.features) == 0
+
+        # grid thumbnails are used instead of the images, when the store has them
+        flat = SimilarityScheduler(thumbnails=FlatStore())
+        features = [flat.image_feature(path) for path in sorted(scheduler.features)[:5]]
+        assert all(np.array_equal(feature, features[0]) for feature in features)
+        assert not np.array_equal(features[0], SimilarityScheduler().image_feature(sorted(scheduler.features)[0]))
+
+    print('Checked background ranking, the feature cache and thumbnail features of the similarity scheduler')
+
+def scenario_seventeen(runs=200):
+    print('***Scenario Seventeen***')
+    random.seed(17)
+
+    num_redrawn = 0
+
+    for run in range(runs):
+        cw = journal_session((NodeCG, ArrayCG)[run % 2], False, run)
+
+        # the questions of a MetaDisplay, without its window
+        display = MetaDisplay.__new__(MetaDisplay)
+        display.ci, display.trust = cw, 100
+
+        for _ in range(20):
+            display.upcoming = display._next_question()
+            if display.upcoming is None:
+                break
+            cluster1, cluster2, image1, image2 = display.upcoming
+
+            # split the image drawn for cluster1 off it, or decide on some other pair
+            if random.random() < 0.5 and len(cw.clusters[cluster1.id]) > 1:
+                cw.problem_with_cluster(cluster1, image1, image1)
+            else:
+                pairing = cw.suggest_pairing()
+                if pairing is not False:
+                    random.choice([cw.is_good_pairing, cw.is_bad_pairing])(*pairing)
+
+            question = display._take_question()
+
+            # a pairing that is still open is asked about, with images it still holds
+            if cw.pairing_open(cluster1, cluster2):
+                assert question[:2] == (cluster1, cluster2) and cw.still_open(*question)
+                num_redrawn += question[2] != image1
+            else:
+                assert question is None or cw.still_open(*question)
+
+    assert num_redrawn > 0
+    print('Checked that {} questions whose images were split off were asked again with other images'.format(num_redrawn))
+
+def scenario_eighteen():
+    print('***Scenario Eighteen***')
+    random.seed(18)
+
+    import numpy as np
+    from PIL import Image
+    from thumbnails import ThumbnailStore
+
+    def write_image(path):
+        Image.new('RGB', (random.randint(20, 60), random.randint(20, 60)), tuple(random.randrange(256) for _ in range(3))).save(path)
+
+    def touch(directory):
+        # moves the mtime on by a second, as filesystems with a coarse clock may not have yet
+        mtime = os.stat(directory).st_mtime_ns + 10 ** 9
+        os.utime(directory, ns=(mtime, mtime))
+
+    with tempfile.TemporaryDirectory() as directory:
+        root = os.path.join(directory, 'ds')
+        paths = []
+        for cluster in range(4):
+            os.makedirs(os.path.join(root, str(cluster)))
+            for i in range(random.randint(1, 5)):
+                paths.append('{}/{}/{}.png'.format(root, cluster, i))
+                write_image(paths[-1])
+        open(os.path.join(root, '0', 'notes.txt'), 'w').close() # not an image
+
+        manifest = DatasetManifest(None, root)
+        manifest.refresh()
+        store = ThumbnailStore(os.path.join(directory, 'ds.thumbs'), grid_size=(8, 8), manifest=manifest)
+        assert store.build(root) == len(paths) + 1
+
+        def colour(path):
+            with Image.open(path) as image:
+                return image.getpixel((0, 0))
+
+        assert all(tuple(store.grid(path)[0, 0]) == colour(path) for path in paths)
+        assert store.grid(os.path.join(root, '0', 'notes.txt')) is None
+
+        # a rewritten image is not shown from its stale thumbnail once the manifest lists its new stamp
+        changed, removed = random.sample(paths, 2)
+        write_image(changed)
+        mtime = os.stat(changed).st_mtime_ns + 10 ** 9
+        os.utime(changed, ns=(mtime, mtime))
+        os.remove(removed)
+        touch(os.path.dirname(changed))
+        touch(os.path.dirname(removed))
+        manifest.refresh()
+
+        assert store.grid(changed) is None and store.grid(removed) is None
+        assert all(store.grid(path) is not None for path in paths if path not in (changed, removed))
+
+        # a build decodes only the rewritten image, and the notes file that is no image again
+        assert store.build(root) == 2
+        assert tuple(store.grid(changed)[0, 0]) == colour(changed) and store.grid(removed) is None
+
+        # a store reopened from disk keeps every thumbnail
+        store = ThumbnailStore(os.path.join(directory, 'ds.thumbs'), manifest=manifest)
+        assert all(tuple(store.grid(path)[0, 0]) == colour(path) for path in paths if path != removed)
+
+    print('Checked that thumbnails are only used while the manifest lists their images unchanged')
+
 # def scenario
 
 if __name__ == "__main__":
@@ -192,3 +1002,35 @@ if __name__ == "__main__":
         print('Scenario Two executed for ~{} nodes'.format(3 * num_nodes))
         scenario_two(num_nodes)
         print('\n')
+
+    scenario_three()
+    print('\n')
+    scenario_four()
+    print('\n')
+    scenario_five()
+    print('\n')
+    scenario_six()
+    print('\n')
+    scenario_seven()
+    print('\n')
+    scenario_eight()
+    print('\n')
+    scenario_nine()
+    print('\n')
+    scenario_ten()
+    print('\n')
+    scenario_eleven()
+    print('\n')
+    scenario_twelve()
+    print('\n')
+    scenario_thirteen()
+    print('\n')
+    scenario_fourteen()
+    print('\n')
+    scenario_fifteen()
+    print('\n')
+    scenario_sixteen()
+    print('\n')
+    scenario_seventeen()
+    print('\n')
+    scenario_eighteen()
@@ -0,0 +1,164 @@
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+from manifest import dataset_manifest, dataset_name
+
+class ThumbnailStore:
+    """
+        Fixed-size uint8 RGB thumbnails of every image in a dataset.
+
+        Thumbnails of each size are packed back to back in one memory-mapped file
+        (`<prefix>.grid.u8` for the 5x5 cluster grid, `<prefix>.pair.u8` for the
+        side-by-side pair view), and `<prefix>.index.json` maps every image path
+        to its slot along with the size and mtime it was built from. Reading a
+        thumbnail is a zero-copy slice of the mapping.
+
+        Pair-view thumbnails take about 1MB per image at 600x600, so they are only
+        kept if a `pair_size` is given. An existing store keeps its sizes (delete it to change them).
+
+        `build` lists the dataset through its `DatasetManifest`, only decodes images
+        that are new or changed since the last build (by the size and mtime the
+        manifest lists) and hands the slots of deleted images to new ones. Given a
+        `manifest`, a thumbnail is only returned while the manifest still lists its
+        image with the size and mtime it was built from.
+    """
+
+    def __init__(self, prefix, grid_size=(120, 120), pair_size=None, manifest=None):
+        self.prefix = prefix
+        self.manifest = manifest
+        self.sizes = {'grid': tuple(grid_size)}
+        if pair_size is not None:
+            self.sizes['pair'] = tuple(pair_size)
+
+        self.images = dict() # path -> [slot, size in bytes, mtime in ns]
+        self.free = [] # slots of deleted images
+        self.num_slots = 0
+        self.maps = dict() # 'grid'/'pair' -> memmap, or None while there are no slots
+
+        if os.path.exists(self._index_path()):
+            with open(self._index_path(), 'r') as f:
+                index = json.load(f)
+
+            self.sizes = {kind: tuple(size) for kind, size in index['sizes'].items()}
+            self.images = index['images']
+            self.free = index['free']
+            self.num_slots = index['num_slots']
+
+        self._open_maps('r')
+
+    def grid(self, path):
+        """
+            Returns the grid thumbnail of `path` as a (height, width, 3) uint8 array, or None if it is not in the store.
+        """
+        return self._thumbnail('grid', path)
+
+    def pair(self, path):
+        """
+            Returns the pair-view thumbnail of `path` as a (height, width, 3) uint8 array, or None if it is not in the store.
+        """
+        return self._thumbnail('pair', path)
+
+    def build(self, master_dir, workers=8, manifest=None):
+        """
+            Brings the store up to date with every file under `master_dir`, as listed by
+            `manifest` (by default, the store's own or else `dataset_manifest(master_dir)`).
+
+            Returns the number of images that were (re)decoded.
+        """
+        if manifest is None:
+            manifest = self.manifest if self.manifest is not None else dataset_manifest(master_dir)
+
+        found = dict()
+        for directory, entry in manifest.dirs.items():
+            for filename, stamp in entry[1].items():
+                found['{}/{}'.format(directory, filename)] = stamp
+
+        for path in [path for path in self.images if path not in found]:
+            self.free.append(self.images.pop(path)[0])
+
+        todo = [path for path, stamp in found.items() if path not in self.images or self.images[path][1:] != stamp]
+
+        slots = dict()
+        for path in todo:
+            if path in self.images:
+                slots[path] = self.images[path][0]
+            elif len(self.free) > 0:
+                slots[path] = self.free.pop()
+            else:
+                slots[path] = self.num_slots
+                self.num_slots += 1
+
+        self._grow()
+        self._open_maps('r+')
+
+        def encode(path):
+            try:
+                with Image.open(path) as image:
+                    image = image.convert('RGB')
+                    for kind, size in self.sizes.items():
+                        self.maps[kind][slots[path]] = np.asarray(image.resize(size))
+                return True
+            except OSError: # not an image
+                return False
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for path, encoded in zip(todo, executor.map(encode, todo)):
+                if encoded:
+                    self.images[path] = [slots[path]] + found[path]
+                else:
+                    self.images.pop(path, None)
+                    self.free.append(slots[path])
+
+        for thumbnails in self.maps.values():
+            if thumbnails is not None: thumbnails.flush()
+
+        with open(self._index_path(), 'w') as f:
+            json.dump({
+                'sizes': self.sizes,
+                'images': self.images,
+                'free': self.free,
+                'num_slots': self.num_slots
+            }, f)
+
+        self._open_maps('r')
+
+        return len(todo)
+
+    def _thumbnail(self, kind, path):
+        entry = self.images.get(path)
+        if entry is None or self.maps.get(kind) is None:
+            return None
+
+        # an image changed or deleted since the last build is decoded instead
+        if self.manifest is not None and self.manifest.stamp(path) != entry[1:]:
+            return None
+
+        return self.maps[kind][entry[0]]
+
+    def _index_path(self):
+        return '{}.index.json'.format(self.prefix)
+
+    def _map_path(self, kind):
+        return '{}.{}.u8'.format(self.prefix, kind)
+
+    def _grow(self):
+        for kind, (width, height) in self.sizes.items():
+            with open(self._map_path(kind), 'ab') as f:
+                f.truncate(self.num_slots * height * width * 3)
+
+    def _open_maps(self, mode):
+        self.maps = dict()
+        for kind, (width, height) in self.sizes.items():
+            if self.num_slots == 0 or not os.path.exists(self._map_path(kind)):
+                self.maps[kind] = None
+            else:
+                self.maps[kind] = np.memmap(self._map_path(kind), dtype=np.uint8, mode=mode, shape=(self.num_slots, height, width, 3))
+
+def dataset_store(master_dir, pair_size=None, manifest=None):
+    """
+        Returns the `ThumbnailStore` of the dataset in `master_dir`, kept next to its verify text file,
+        whose thumbnails are checked against `manifest`, the dataset's `DatasetManifest`, if given.
+    """
+    return ThumbnailStore('data/{}.thumbs'.format(dataset_name(master_dir)), pair_size=pair_size, manifest=manifest)